@@ -1,13 +1,44 @@
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
+from sklearn.base import clone
 from sklearn.linear_model import LinearRegression
+from sklearn.inspection import permutation_importance
 from sklearn.metrics import mean_absolute_error, r2_score
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import train_test_split, cross_val_score, KFold
 import joblib
 import json
+import math
 from typing import Dict, List, Tuple, Any
 from ml_optimizer.feature_extraction import extract_features
+from util.model_io import load_dump
+
+try:
+    import lz4
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+# lz4 is near-free to decompress; zlib is the stdlib fallback
+MODEL_COMPRESS = ('lz4', 3) if LZ4_AVAILABLE else ('zlib', 3)
+
+# Features used by the ensemble, in model column order
+IMPORTANT_FEATURES: Tuple[str, ...] = (
+    'num_tables', 'num_joins', 'query_length', 'num_conditions',
+    'query_complexity', 'has_order_by', 'num_aggregates', 'has_subquery',
+    'has_union', 'max_nesting_depth'
+)
+_IMPORTANT_FEATURES_SET = frozenset(IMPORTANT_FEATURES)
+_FEATURE_INDEX = {f: i for i, f in enumerate(IMPORTANT_FEATURES)}
+
+
+def features_to_vector(features: Dict[str, Any]) -> np.ndarray:
+    """Assemble the float32 model input row for a feature dict (missing features are 0)"""
+    vec = np.zeros(len(IMPORTANT_FEATURES), dtype=np.float32)
+    for k, v in features.items():
+        i = _FEATURE_INDEX.get(k)
+        if i is not None:
+            vec[i] = v
+    return vec
 
 class AdvancedMLOptimizer:
     """Advanced ML-based query optimization with multiple models and ensemble learning"""
@@ -17,6 +48,8 @@ class AdvancedMLOptimizer:
         self.ensemble_weights = {}
         self.feature_importance = {}
         self.model_performance = {}
+        self._predict_order = []
+        self._n_features = len(IMPORTANT_FEATURES)
         
     def train_ensemble_models(self, queries: List[str], actual_costs: List[float], 
                             features_data: List[Dict] = None) -> Dict[str, Any]:
@@ -26,22 +59,15 @@ class AdvancedMLOptimizer:
         if features_data is None:
             features_data = [extract_features(query) for query in queries]
         
-        # Convert to DataFrame
-        df = pd.DataFrame(features_data)
-        
-        # Select most important features (you can expand this list)
-        important_features = [
-            'num_tables', 'num_joins', 'query_length', 'num_conditions', 
-            'query_complexity', 'has_order_by', 'num_aggregates', 'has_subquery',
-            'has_union', 'max_nesting_depth'
-        ]
+        # Select most important features (see IMPORTANT_FEATURES)
+        important_features = list(IMPORTANT_FEATURES)
         
-        # Ensure we have these features
-        for feature in important_features:
-            if feature not in df.columns:
-                df[feature] = 0
-        
-        X = df[important_features].fillna(0)
+        # Build the row-major float32 matrix directly; missing features are 0
+        X = np.zeros((len(features_data), len(IMPORTANT_FEATURES)), dtype=np.float32)
+        for i, feats in enumerate(features_data):
+            for j, name in enumerate(IMPORTANT_FEATURES):
+                X[i, j] = feats.get(name, 0) or 0
+        np.nan_to_num(X, copy=False)
         y = np.array(actual_costs)
         
         # Split data
@@ -53,10 +79,11 @@ class AdvancedMLOptimizer:
                 n_estimators=100, 
                 max_depth=10, 
                 min_samples_split=5,
-                random_state=42
+                random_state=42,
+                n_jobs=-1
             ),
-            'gradient_boosting': GradientBoostingRegressor(
-                n_estimators=100,
+            'gradient_boosting': HistGradientBoostingRegressor(
+                max_iter=100,
                 max_depth=6,
                 learning_rate=0.1,
                 random_state=42
@@ -74,6 +101,9 @@ class AdvancedMLOptimizer:
         # Train each model
         model_predictions = {}
         
+        # Linear regression is deterministic; extra folds add little beyond refit time
+        cv_folds = {'linear_regression': KFold(n_splits=3)}
+        
         for name, model in model_configs.items():
             print(f"Training {name}...")
             
@@ -90,8 +120,14 @@ class AdvancedMLOptimizer:
             train_r2 = r2_score(y_train, train_pred)
             test_r2 = r2_score(y_test, test_pred)
             
-            # Cross-validation score
-            cv_scores = cross_val_score(model, X_train, y_train, cv=5, scoring='neg_mean_absolute_error')
+            # Cross-validation score: folds run in parallel on loky, so each fold's
+            # estimator fits single-threaded rather than nesting another pool
+            cv_model = clone(model)
+            if 'n_jobs' in cv_model.get_params():
+                cv_model.set_params(n_jobs=1)
+            with joblib.parallel_backend('loky', n_jobs=-1):
+                cv_scores = cross_val_score(cv_model, X_train, y_train, cv=cv_folds.get(name, 5),
+                                            scoring='neg_mean_absolute_error')
             cv_mae = -cv_scores.mean()
             
             # Store model and metrics
@@ -111,10 +147,17 @@ class AdvancedMLOptimizer:
             self.model_performance[name] = performance
             
             # Feature importance (if available)
+            importance = None
             if hasattr(model, 'feature_importances_'):
-                importance_dict = dict(zip(important_features, model.feature_importances_))
-                results['feature_importance'][name] = importance_dict
-                self.feature_importance[name] = importance_dict
+                importance = (IMPORTANT_FEATURES, np.asarray(model.feature_importances_))
+            elif isinstance(model, HistGradientBoostingRegressor):
+                # No impurity importances on histogram GB: measure held-out MAE drop instead
+                perm = permutation_importance(model, X_test, y_test, n_repeats=5, random_state=42,
+                                              scoring='neg_mean_absolute_error')
+                importance = (IMPORTANT_FEATURES, np.asarray(perm.importances_mean))
+            if importance is not None:
+                results['feature_importance'][name] = importance
+                self.feature_importance[name] = importance
             
             print(f"  {name}: Test MAE={test_mae:.3f}, Test R²={test_r2:.3f}, CV MAE={cv_mae:.3f}")
         
@@ -128,6 +171,8 @@ class AdvancedMLOptimizer:
         
         self.ensemble_weights = weights
         results['ensemble_weights'] = weights
+        self._predict_order = list(self.models.items())
+        self._n_features = len(IMPORTANT_FEATURES)
         
         # Test ensemble performance
         ensemble_pred = self._ensemble_predict(X_test, weights)
@@ -151,45 +196,44 @@ class AdvancedMLOptimizer:
         
         return results
     
-    def _ensemble_predict(self, X: pd.DataFrame, weights: Dict[str, float] = None) -> np.ndarray:
+    def _ensemble_predict(self, X: np.ndarray, weights: Dict[str, float] = None) -> np.ndarray:
         """Make ensemble predictions"""
         if weights is None:
             weights = self.ensemble_weights
         
-        predictions = []
+        X = np.ascontiguousarray(X, dtype=np.float32).reshape(-1, self._n_features)
+        
+        # Accumulate weighted predictions in place instead of stacking per-model temporaries
+        out = np.zeros(X.shape[0], dtype=np.float64)
         total_weight = 0
         
-        for name, model in self.models.items():
+        for name, model in self._predict_order:
             if name in weights:
-                pred = model.predict(X)
                 weight = weights[name]
-                predictions.append(pred * weight)
+                out += weight * model.predict(X)
                 total_weight += weight
         
         if total_weight == 0:
             # Fallback to equal weights
-            return np.mean([model.predict(X) for model in self.models.values()], axis=0)
+            for _, model in self._predict_order:
+                out += model.predict(X)
+            out /= max(1, len(self._predict_order))
+            return out
         
-        return np.sum(predictions, axis=0) / total_weight
+        out *= 1.0 / total_weight
+        return out
     
     def predict_cost(self, query: str, use_ensemble: bool = True) -> Dict[str, float]:
         """Predict query cost using trained models"""
         features = extract_features(query)
         
         # Prepare feature vector
-        important_features = [
-            'num_tables', 'num_joins', 'query_length', 'num_conditions',
-            'query_complexity', 'has_order_by', 'num_aggregates', 'has_subquery',
-            'has_union', 'max_nesting_depth'
-        ]
-        
-        feature_vector = [features.get(f, 0) for f in important_features]
-        X = pd.DataFrame([feature_vector], columns=important_features)
+        X = features_to_vector(features).reshape(1, -1)
         
         predictions = {}
         
         # Individual model predictions
-        for name, model in self.models.items():
+        for name, model in self._predict_order:
             try:
                 pred = model.predict(X)[0]
                 predictions[f'{name}_prediction'] = pred
@@ -214,38 +258,47 @@ class AdvancedMLOptimizer:
                           if k.endswith('_prediction') and k != 'ensemble_prediction' and v is not None]
         
         if len(individual_preds) > 1:
-            predictions['prediction_std'] = np.std(individual_preds)
-            predictions['prediction_variance'] = np.var(individual_preds)
-            predictions['confidence'] = max(0, 1 - (np.std(individual_preds) / np.mean(individual_preds)))
+            # At most one value per model, so plain scalar math beats round-tripping through numpy
+            n = len(individual_preds)
+            mean = sum(individual_preds) / n
+            var = sum((x - mean) ** 2 for x in individual_preds) / n
+            std = math.sqrt(var)
+            predictions['prediction_std'] = std
+            predictions['prediction_variance'] = var
+            predictions['confidence'] = max(0, 1 - (std / mean)) if mean else 0
         
         return predictions
     
-    def save_models(self, filepath: str):
-        """Save all trained models"""
+    def save_models(self, filepath: str, serving_filepath: str = None):
+        """Save all trained models (compressed); optionally also an uncompressed copy for mmap loading"""
         model_data = {
             'models': self.models,
             'ensemble_weights': self.ensemble_weights,
             'feature_importance': self.feature_importance,
             'model_performance': self.model_performance,
             'version': '2.0',
-            'features': [
-                'num_tables', 'num_joins', 'query_length', 'num_conditions',
-                'query_complexity', 'has_order_by', 'num_aggregates', 'has_subquery',
-                'has_union', 'max_nesting_depth'
-            ]
+            'features': list(IMPORTANT_FEATURES)
         }
         
-        joblib.dump(model_data, filepath)
+        joblib.dump(model_data, filepath, compress=MODEL_COMPRESS, protocol=5)
         print(f"Advanced models saved to {filepath}")
+        
+        if serving_filepath:
+            # Compressed dumps can't be memory-mapped, so serving gets a raw copy
+            joblib.dump(model_data, serving_filepath, protocol=5)
+            print(f"Serving copy saved to {serving_filepath}")
     
     def load_models(self, filepath: str):
         """Load trained models"""
         try:
-            model_data = joblib.load(filepath)
+            # Serving copies are memory-mapped; compressed dumps are read normally
+            model_data = load_dump(filepath, mmap_mode='r')
             self.models = model_data['models']
             self.ensemble_weights = model_data.get('ensemble_weights', {})
             self.feature_importance = model_data.get('feature_importance', {})
             self.model_performance = model_data.get('model_performance', {})
+            self._predict_order = list(self.models.items())
+            self._n_features = len(model_data.get('features', IMPORTANT_FEATURES))
             print(f"Advanced models loaded from {filepath}")
             return True
         except Exception as e:
@@ -288,11 +341,15 @@ class AdvancedMLOptimizer:
             
             if 'random_forest' in self.feature_importance:
                 rf_importance = self.feature_importance['random_forest']
-                sorted_features = sorted(rf_importance.items(), key=lambda x: x[1], reverse=True)
+                if isinstance(rf_importance, dict):
+                    # Models saved before importances were stored as (names, array)
+                    names, imp = tuple(rf_importance), np.fromiter(rf_importance.values(), dtype=float)
+                else:
+                    names, imp = rf_importance
                 
-                for feature, importance in sorted_features[:10]:  # Top 10
-                    bar = "█" * int(importance * 50)  # Visual bar
-                    report.append(f"  {feature:20} {importance:.3f} {bar}")
+                for i in np.argsort(-imp, kind='stable')[:10]:  # Top 10
+                    bar = "█" * int(imp[i] * 50)  # Visual bar
+                    report.append(f"  {names[i].ljust(20)} {imp[i]:.3f} {bar}")
         
         # Ensemble weights
         if self.ensemble_weights:
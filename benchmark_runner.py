@@ -1,21 +1,25 @@
 # benchmark_runner.py
 import argparse
+import atexit
 import json
-import csv
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+import numpy as np
 import pandas as pd
 from rewriter import generate_join_candidates
-from explain_runner import run_explain  # returns EXPLAIN (FORMAT JSON) parsed
+from explain_runner import run_explain_many  # returns EXPLAIN (FORMAT JSON) parsed
 from cost_model import get_query_cost
-from query_logger import log_query
+from query_logger import log_queries
 from ml_optimizer.train_model import train_model_function
-import joblib
-from ml_optimizer.feature_extraction import extract_features
+from joblib import Parallel, delayed
+from ml_optimizer.feature_extraction import extract_features, features_to_matrix
 from db import get_connection
+from util.model_io import load_dump
 
 # Try load ML predictor
 try:
-    md = joblib.load("cost_predictor.joblib")
+    # mmap the tree arrays so forked benchmark workers share one read-only copy
+    md = load_dump("cost_predictor.joblib", mmap_mode="r")
     cost_model = md["model"] if isinstance(md, dict) and "model" in md else md
     trained_features = md.get("features") if isinstance(md, dict) else None
     print("✅ ML cost predictor loaded for benchmark.")
@@ -25,158 +29,304 @@ except Exception:
     print("⚠️ No ML predictor found; using DB EXPLAIN for ranking.")
 
 
-def best_candidate_for_query(query: str) -> dict:
-    """Generate candidates and pick best using ML or EXPLAIN cost."""
-    candidates = generate_join_candidates(query, max_permutations=10)
-    scored = []
-
-    for q in candidates:
-        feats = extract_features(q, None)
-
-        if cost_model and trained_features:
-            try:
-                # Use only the features the model was trained with
-                fv = [feats.get(f, 0) for f in trained_features]
-                X = pd.DataFrame([fv], columns=trained_features)
-                pred = cost_model.predict(X)[0]
-            except Exception as e:
-                print(f"⚠️ ML prediction failed: {e}")
-                pred = get_query_cost(q)
-        elif cost_model:
-            try:
-                # Try with all features
-                X = pd.DataFrame([feats])
-                pred = cost_model.predict(X)[0]
-            except Exception:
-                pred = get_query_cost(q)
-        else:
-            pred = get_query_cost(q)
+def _predict_costs(feats_list: List[dict]):
+    """Score a batch of feature dicts with one predict call; None if unavailable."""
+    if cost_model and trained_features:
+        try:
+            # Use only the features the model was trained with
+            X = features_to_matrix(feats_list, trained_features)
+            return cost_model.predict(X)
+        except Exception as e:
+            print(f"⚠️ ML prediction failed: {e}")
+    elif cost_model:
+        try:
+            # Try with all features
+            X = pd.DataFrame(feats_list)
+            return cost_model.predict(X)
+        except Exception:
+            pass
+    return None
+
 
-        scored.append((q, pred))
+def best_candidates_for_queries(queries: List[str]) -> List[dict]:
+    """Generate candidates for every query and score them all with a single predict call."""
+    cand_lists = [generate_join_candidates(q, max_permutations=10) for q in queries]
+    offsets = np.zeros(len(queries) + 1, dtype=np.intp)
+    np.cumsum([len(c) for c in cand_lists], out=offsets[1:])
 
-    best_q, best_cost = sorted(scored, key=lambda x: x[1])[0]
-    return {"best_query": best_q, "best_cost": best_cost, "candidates": scored}
+    all_candidates = [c for cands in cand_lists for c in cands]
+    all_feats = [extract_features(c, None) for c in all_candidates]
 
+    ml_preds = _predict_costs(all_feats)
+    if ml_preds is not None:
+        preds_all = ml_preds
+    else:
+        preds_all = np.array([get_query_cost(c) for c in all_candidates], dtype=float)
+
+    picks = []
+    for k, query in enumerate(queries):
+        lo, hi = offsets[k], offsets[k + 1]
+        candidates, preds, feats_list = cand_lists[k], preds_all[lo:hi], all_feats[lo:hi]
+        # Linear min scan; a NaN prediction must never win the argmin
+        i = int(np.argmin(np.where(np.isnan(preds), np.inf, preds)))
+        j = candidates.index(query) if query in candidates else None
+        picks.append({
+            "best_query": candidates[i],
+            "best_cost": float(preds[i]),
+            "candidates": list(zip(candidates, preds)),
+            "features": feats_list,
+            "orig_features": feats_list[j] if j is not None else extract_features(query, None),
+            # ML score of the original itself, already computed as part of the batch
+            "orig_pred": ml_preds[lo + j] if ml_preds is not None and j is not None else None,
+        })
+    return picks
+
+
+def best_candidate_for_query(query: str) -> dict:
+    """Generate candidates and pick best using ML or EXPLAIN cost."""
+    return best_candidates_for_queries([query])[0]
 
-def run_explain_analyze_safe(conn, query: str):
-    """Run EXPLAIN ANALYZE (executes query)."""
+
+def run_explain_analyze_safe(conn, query: str, cur=None):
+    """Run EXPLAIN ANALYZE (executes query). Pass `cur` to reuse a long-lived cursor."""
+    own_cur = cur is None
     try:
-        cur = conn.cursor()
+        if own_cur:
+            cur = conn.cursor()
         cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query)
         row = cur.fetchone()
-        cur.close()
         if row:
             return row[0][0] if isinstance(row[0], list) else row[0]
     except Exception as e:
         print("❌ EXPLAIN ANALYZE failed:", e)
+        # Clear the aborted transaction so the shared connection stays usable
+        conn.rollback()
+    finally:
+        if own_cur and cur is not None:
+            cur.close()
     return None
 
 
-def run_benchmark(queries: List[str], mode: str = "explain", retrain: bool = False):
-    conn = get_connection() if mode == "analyze" else None
-    results = []
-
-    for i, q in enumerate(queries, 1):
-        print(f"\n=== Query {i}/{len(queries)} ===")
-        print(q.strip()[:400], "...\n")
-
-        # Best candidate
-        pick = best_candidate_for_query(q)
-        best_q, best_pred = pick["best_query"], pick["best_cost"]
-
-        # EXPLAIN costs
-        explain_orig = run_explain(q)
-        orig_cost = explain_orig.get("Plan", {}).get("Total Cost") if explain_orig else None
-        explain_best = run_explain(best_q)
-        best_cost_est = explain_best.get("Plan", {}).get("Total Cost") if explain_best else None
-
-        # ANALYZE runtimes
-        orig_analyze, best_analyze = None, None
-        orig_runtime, best_runtime = None, None
-        if mode == "analyze" and conn:
-            print("Running EXPLAIN ANALYZE on original (may execute query) ...")
-            orig_analyze = run_explain_analyze_safe(conn, q)
-            if orig_analyze and "Actual Total Time" in orig_analyze:
-                orig_runtime = orig_analyze["Actual Total Time"]
-
+def _normalize_sql(query: str) -> str:
+    """Collapse whitespace and drop trailing semicolons for equality checks."""
+    return " ".join(query.split()).rstrip(";").rstrip()
+
+
+# Concurrent DB connections used for the up-front EXPLAIN pass
+EXPLAIN_WORKERS = 8
+
+
+def _explain_unique(texts: List[str], max_workers: int = EXPLAIN_WORKERS) -> dict:
+    """
+    EXPLAIN each distinct query once (by _normalize_sql) in the parent process.
+    Returns {normalized query: plan or None}; workers only look plans up.
+    """
+    pending = {}
+    for text in texts:
+        pending.setdefault(_normalize_sql(text), text)
+    if not pending:
+        return {}
+    keys, queries = list(pending), list(pending.values())
+    n = max(1, min(max_workers, len(keys)))
+    if n == 1:
+        return dict(zip(keys, run_explain_many(queries)))
+    # I/O bound round-trips: stripe them over threads, one pooled connection each
+    plans = {}
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        for i, stripe in enumerate(pool.map(run_explain_many, [queries[i::n] for i in range(n)])):
+            plans.update(zip(keys[i::n], stripe))
+    return plans
+
+
+CSV_COLUMNS = [
+    "original_query", "best_query", "orig_cost", "best_cost_est",
+    "ml_pred", "runtime_orig", "runtime_best",
+    "improvement_runtime_pct", "improvement_ml_pct"
+]
+CSV_BATCH_SIZE = 256
+# query_logs rows per multi-row INSERT
+LOG_BATCH_SIZE = 100
+
+def _write_csv_batch(f, rows: List[dict], header: bool = False):
+    """Append result rows to an open CSV file via pandas' C writer."""
+    pd.DataFrame(rows, columns=CSV_COLUMNS).to_csv(f, header=header, index=False)
+
+
+_worker_conn = None
+_worker_cur = None
+
+
+def _get_worker_connection():
+    """Lazily open one DB connection per worker process and reuse it across queries."""
+    global _worker_conn
+    if _worker_conn is None or _worker_conn.closed:
+        _worker_conn = get_connection()
+    return _worker_conn
+
+
+def _get_worker_cursor():
+    """Return this process's long-lived cursor on the worker connection."""
+    global _worker_cur
+    conn = _get_worker_connection()
+    if _worker_cur is None or _worker_cur.closed or _worker_cur.connection is not conn:
+        _worker_cur = conn.cursor()
+    return _worker_cur
+
+
+def _close_worker_connection():
+    """Close this process's benchmark connection, if one was opened."""
+    global _worker_conn, _worker_cur
+    if _worker_cur is not None:
+        if not _worker_cur.closed:
+            _worker_cur.close()
+        _worker_cur = None
+    if _worker_conn is not None:
+        _worker_conn.close()
+        _worker_conn = None
+
+
+# loky workers import this module too, so each one closes its own connection on exit
+atexit.register(_close_worker_connection)
+
+
+def _process_query(q: str, pick: dict, explain_orig, explain_best, mode: str, label: str):
+    """
+    Benchmark a single query: EXPLAIN/ANALYZE original and picked candidate.
+    The EXPLAIN plans of both are fetched up front by iter_benchmark.
+    Returns (result, log_row); iter_benchmark writes the log rows in batches.
+    """
+    print(f"\n=== Query {label} ===")
+    print(q.strip()[:400], "...\n")
+
+    # Best candidate
+    best_q, best_pred = pick["best_query"], pick["best_cost"]
+    # Whitespace / trailing-semicolon variants of the original are the same query
+    same = _normalize_sql(best_q) == _normalize_sql(q)
+
+    # EXPLAIN costs
+    if same:
+        explain_best = explain_orig
+    orig_cost = explain_orig.get("Plan", {}).get("Total Cost") if explain_orig else None
+    best_cost_est = explain_best.get("Plan", {}).get("Total Cost") if explain_best else None
+
+    # ANALYZE runtimes
+    orig_analyze, best_analyze = None, None
+    orig_runtime, best_runtime = None, None
+    if mode == "analyze":
+        conn, cur = _get_worker_connection(), _get_worker_cursor()
+        print("Running EXPLAIN ANALYZE on original (may execute query) ...")
+        orig_analyze = run_explain_analyze_safe(conn, q, cur)
+        if orig_analyze and "Actual Total Time" in orig_analyze:
+            orig_runtime = orig_analyze["Actual Total Time"]
+
+        if same:
+            # The original won; don't execute it a second time
+            best_analyze, best_runtime = orig_analyze, orig_runtime
+        else:
             print("Running EXPLAIN ANALYZE on best candidate ...")
-            best_analyze = run_explain_analyze_safe(conn, best_q)
+            best_analyze = run_explain_analyze_safe(conn, best_q, cur)
             if best_analyze and "Actual Total Time" in best_analyze:
                 best_runtime = best_analyze["Actual Total Time"]
 
-        # ML prediction
-        ml_pred = None
-        if cost_model and trained_features:
-            try:
-                feats = extract_features(q, None)
-                fv = [feats.get(f, 0) for f in trained_features]
-                X = pd.DataFrame([fv], columns=trained_features)
-                ml_pred = cost_model.predict(X)[0]
-                if pd.isna(ml_pred):
-                    ml_pred = get_query_cost(q)
-            except Exception as e:
-                print(f"⚠️ ML prediction failed: {e}")
-                ml_pred = get_query_cost(q)
-        elif cost_model:
-            try:
-                feats = extract_features(q, None)
-                X = pd.DataFrame([feats])
-                ml_pred = cost_model.predict(X)[0]
-                if pd.isna(ml_pred):
-                    ml_pred = get_query_cost(q)
-            except Exception as e:
-                print(f"⚠️ ML prediction failed: {e}")
-                ml_pred = get_query_cost(q)
-
-        # Improvements
-        improvement_pct_runtime = None
-        improvement_pct_ml = None
-
-        if orig_runtime and best_runtime:
-            improvement_pct_runtime = (orig_runtime - best_runtime) / orig_runtime * 100.0
-            print(f"Original runtime: {orig_runtime:.2f} ms | Best runtime: {best_runtime:.2f} ms")
-            print(f"Improvement (runtime): {improvement_pct_runtime:.2f}%")
-
-        if orig_runtime and ml_pred:
-            improvement_pct_ml = (orig_runtime - ml_pred) / orig_runtime * 100.0
-            print(f"Original runtime (ANALYZE): {orig_runtime:.2f} ms | ML-pred runtime: {ml_pred:.2f} ms")
-            print(f"Estimated improvement (ML vs Original): {improvement_pct_ml:.2f}%")
-
-        print(f"Original cost (EXPLAIN): {orig_cost} | Best estimated (EXPLAIN): {best_cost_est} | ML-picked pred: {ml_pred}")
-
-        # Log
-        log_query(
-            q, best_q,
-            orig_cost or 0.0, best_cost_est or best_pred or 0.0,
-            predicted_cost=ml_pred,
-            runtime=orig_runtime,
-            explain_original=explain_orig,
-            explain_rewritten=explain_best
-        )
-
-        results.append({
-            "original_query": q,
-            "best_query": best_q,
-            "orig_cost": orig_cost,
-            "best_cost_est": best_cost_est,
-            "ml_pred": ml_pred,
-            "runtime_orig": orig_runtime,
-            "runtime_best": best_runtime,
-            "improvement_runtime_pct": improvement_pct_runtime,
-            "improvement_ml_pct": improvement_pct_ml,
-            "explain_original": explain_orig,
-            "explain_rewritten": explain_best,
-            "analyze_original": orig_analyze,
-            "analyze_best": best_analyze
-        })
-
-    if conn:
-        conn.close()
+    # ML prediction
+    ml_pred = None
+    if cost_model:
+        ml_pred = pick["orig_pred"]
+        if ml_pred is None:
+            preds = _predict_costs([pick["orig_features"]])
+            ml_pred = preds[0] if preds is not None else None
+        if ml_pred is None or pd.isna(ml_pred):
+            ml_pred = get_query_cost(q)
+
+    # Improvements
+    improvement_pct_runtime = None
+    improvement_pct_ml = None
+
+    if orig_runtime and best_runtime:
+        improvement_pct_runtime = (orig_runtime - best_runtime) / orig_runtime * 100.0
+        print(f"Original runtime: {orig_runtime:.2f} ms | Best runtime: {best_runtime:.2f} ms")
+        print(f"Improvement (runtime): {improvement_pct_runtime:.2f}%")
+
+    if orig_runtime and ml_pred:
+        improvement_pct_ml = (orig_runtime - ml_pred) / orig_runtime * 100.0
+        print(f"Original runtime (ANALYZE): {orig_runtime:.2f} ms | ML-pred runtime: {ml_pred:.2f} ms")
+        print(f"Estimated improvement (ML vs Original): {improvement_pct_ml:.2f}%")
+
+    print(f"Original cost (EXPLAIN): {orig_cost} | Best estimated (EXPLAIN): {best_cost_est} | ML-picked pred: {ml_pred}")
+
+    # Log (log_query keyword arguments)
+    log_row = dict(
+        original_query=q, rewritten_query=best_q,
+        original_cost=orig_cost or 0.0, rewritten_cost=best_cost_est or best_pred or 0.0,
+        predicted_cost=ml_pred,
+        runtime=orig_runtime,
+        explain_original=explain_orig,
+        explain_rewritten=explain_best
+    )
+
+    return {
+        "original_query": q,
+        "best_query": best_q,
+        "orig_cost": orig_cost,
+        "best_cost_est": best_cost_est,
+        "ml_pred": ml_pred,
+        "runtime_orig": orig_runtime,
+        "runtime_best": best_runtime,
+        "improvement_runtime_pct": improvement_pct_runtime,
+        "improvement_ml_pct": improvement_pct_ml,
+        "explain_original": explain_orig,
+        "explain_rewritten": explain_best,
+        "analyze_original": orig_analyze,
+        "analyze_best": best_analyze
+    }, log_row
+
+
+def iter_benchmark(queries: List[str], mode: str = "explain", n_jobs: int = -1):
+    """
+    Yield per-query benchmark results in input order as workers complete them.
+    In analyze mode queries run one at a time so the measured runtimes don't
+    compete with each other for the database.
+    """
+    if mode == "analyze":
+        n_jobs = 1
+    # Score all candidates of all queries up front in one batch
+    picks = best_candidates_for_queries(queries)
+
+    # EXPLAIN every distinct original/pick once here rather than per worker
+    plans = _explain_unique([text for q, pick in zip(queries, picks) for text in (q, pick["best_query"])])
+
+    # The remaining per-query work is independent DB round-trips, so fan it out to workers
+    total = len(queries)
+    log_rows = []
+    try:
+        for result, log_row in Parallel(n_jobs=n_jobs, backend="loky", return_as="generator")(
+            delayed(_process_query)(q, pick, plans[_normalize_sql(q)],
+                                    plans[_normalize_sql(pick["best_query"])], mode, f"{i}/{total}")
+            for i, (q, pick) in enumerate(zip(queries, picks), 1)
+        ):
+            log_rows.append(log_row)
+            if len(log_rows) >= LOG_BATCH_SIZE:
+                log_queries(log_rows)
+                log_rows.clear()
+            yield result
+    finally:
+        # One multi-row INSERT for whatever is left
+        log_queries(log_rows)
+        # n_jobs=1 runs in-process, so release the connection opened here
+        _close_worker_connection()
+
+
+def _retrain_from_logs():
+    print("\nRetraining ML model from logged data...")
+    train_model_function()
+    print("Retrain finished.")
+
+
+def run_benchmark(queries: List[str], mode: str = "explain", retrain: bool = False, n_jobs: int = -1):
+    results = list(iter_benchmark(queries, mode=mode, n_jobs=n_jobs))
 
     if retrain:
-        print("\nRetraining ML model from logged data...")
-        train_model_function()
-        print("Retrain finished.")
+        _retrain_from_logs()
 
     return results
 
@@ -187,6 +337,7 @@ if __name__ == "__main__":
     parser.add_argument("--mode", choices=["explain", "analyze"], default="explain")
     parser.add_argument("--retrain", action="store_true")
     parser.add_argument("--dummy", action="store_true")
+    parser.add_argument("--jobs", type=int, default=-1, help="Parallel workers (-1 = all cores; analyze mode always runs sequentially)")
     args = parser.parse_args()
 
     # Queries
@@ -207,26 +358,28 @@ if __name__ == "__main__":
             "SELECT * FROM employees e JOIN departments d ON e.dept_id = d.dept_id;"
         ]
 
-    results = run_benchmark(queries, mode=args.mode, retrain=args.retrain)
-
-    # Save JSON
-    with open("benchmark_results.json", "w", encoding="utf-8") as f:
-        json.dump(results, f, default=str, indent=2)
-
-    # Save CSV
-    with open("benchmark_results.csv", "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "original_query", "best_query", "orig_cost", "best_cost_est",
-            "ml_pred", "runtime_orig", "runtime_best",
-            "improvement_runtime_pct", "improvement_ml_pct"
-        ])
-        for r in results:
-            writer.writerow([
-                r["original_query"], r["best_query"], r["orig_cost"],
-                r["best_cost_est"], r["ml_pred"], r["runtime_orig"],
-                r["runtime_best"], r["improvement_runtime_pct"],
-                r["improvement_ml_pct"]
-            ])
+    # Stream results to disk as each query completes so memory stays flat and an
+    # interrupted run keeps everything finished so far; CSV rows are flushed in batches
+    with open("benchmark_results.json", "w", encoding="utf-8") as f_json, \
+            open("benchmark_results.csv", "w", newline="", encoding="utf-8") as f_csv:
+        _write_csv_batch(f_csv, [], header=True)
+        pending = []
+        f_json.write("[\n")
+        try:
+            for n, r in enumerate(iter_benchmark(queries, mode=args.mode, n_jobs=args.jobs)):
+                if n:
+                    f_json.write(",\n")
+                f_json.write(json.dumps(r, default=str, indent=2))
+                pending.append(r)
+                if len(pending) >= CSV_BATCH_SIZE:
+                    _write_csv_batch(f_csv, pending)
+                    pending.clear()
+        finally:
+            f_json.write("\n]\n")
+            if pending:
+                _write_csv_batch(f_csv, pending)
+
+    if args.retrain:
+        _retrain_from_logs()
 
     print("\nBenchmark complete. Results written to benchmark_results.json and benchmark_results.csv")
@@ -2,25 +2,150 @@
 """
 Improved cost comparison system for SQL optimizer
 """
+import os
+import threading
 import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple, Optional
-from explain_runner import run_explain
-from cost_model import get_query_cost, load_cost_model
-from ml_optimizer.feature_extraction import extract_features
-import pandas as pd
+from explain_runner import run_explain, run_explain_many
+from cost_model import calculate_heuristic_cost, load_cost_model, load_onnx_session
+from ml_optimizer.feature_extraction import extract_features, features_to_matrix
+from util.fingerprint import fp
+import joblib
 import numpy as np
 
+# Concurrent DB connections used when prefetching candidate plans
+EXPLAIN_WORKERS = 8
+
+# Entries kept per comparator cache before the least recently used is evicted
+CACHE_SIZE = 1024
+
+# Set to a directory to persist extracted features across processes/runs
+FEATURE_CACHE_DIR = os.getenv("SQLOPT_FEATURE_CACHE_DIR")
+if FEATURE_CACHE_DIR:
+    _extract_features = joblib.Memory(FEATURE_CACHE_DIR, verbose=0).cache(extract_features)
+else:
+    _extract_features = extract_features
+
+
+class _LRUCache(OrderedDict):
+    """Dict that keeps at most `maxsize` entries, evicting the least recently used"""
+
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
 class CostComparator:
     """Handles cost comparison between query candidates with proper error handling"""
     
-    def __init__(self):
-        self.model, self.trained_features = load_cost_model()
-        self.use_ml = self.model is not None
+    def __init__(self, model_path: str = "cost_predictor.joblib"):
+        # The model is loaded on first ML use so heuristic-only callers skip the unpickle
+        self.model_path = model_path
+        self._model = None
+        self._trained_features = []
+        self._onnx_session, self._onnx_input = None, None
+        self._model_loaded = False
+        self._model_lock = threading.Lock()
+        # Bounded LRU caches. Plans are keyed by util.fingerprint.fp(query); features
+        # (query_length etc.) and what's derived from the text are keyed by the raw query
+        self._ml_cache: Dict[str, Optional[float]] = _LRUCache()
+        self._feat_cache: Dict[str, dict] = _LRUCache()
+        self._lower_cache: Dict[str, str] = _LRUCache()
+        self._plan_cache: Dict[int, Optional[dict]] = _LRUCache()
+    
+    def _ensure_model(self):
+        if self._model_loaded:
+            return
+        with self._model_lock:
+            if self._model_loaded:
+                return
+            # mmap the tree arrays instead of copying them into this process
+            self._model, self._trained_features = load_cost_model(self.model_path, mmap_mode='r')
+            self._trained_features = self._trained_features or []
+            self._feat_buf = np.zeros((1, len(self._trained_features)), dtype=np.float32)
+            self._feat_index = {f: i for i, f in enumerate(self._trained_features)}
+            if self._model is not None and self._trained_features:
+                # Prefer compiled ONNX inference when an export sits next to the model
+                self._onnx_session, self._onnx_input = load_onnx_session(self.model_path)
+            self._model_loaded = True
+    
+    def _run_model(self, X) -> np.ndarray:
+        """Predict with the ONNX session when available, else the sklearn model"""
+        if self._onnx_session is not None and isinstance(X, np.ndarray):
+            out = self._onnx_session.run(None, {self._onnx_input: X.astype(np.float32, copy=False)})[0]
+            return np.ravel(out)
+        with warnings.catch_warnings():
+            # Raw arrays lack the column names some saved models were fitted with
+            warnings.simplefilter('ignore')
+            return self.model.predict(X)
+    
+    @property
+    def model(self):
+        self._ensure_model()
+        return self._model
+    
+    @property
+    def trained_features(self) -> List[str]:
+        self._ensure_model()
+        return self._trained_features
+    
+    @property
+    def use_ml(self) -> bool:
+        return self.model is not None
+    
+    def _get_plan(self, query: str, key: int = None) -> Optional[dict]:
+        """Single EXPLAIN ANALYZE per query; both cost and runtime are read from it"""
+        if key is None:
+            key = fp(query)
+        if key not in self._plan_cache:
+            # The canonical form is only a cache key; Postgres gets the query as written
+            self._plan_cache[key] = run_explain(query)
+        return self._plan_cache[key]
+    
+    def clear_plan_cache(self):
+        """Drop cached plans; features and ML predictions don't depend on them and are kept"""
+        self._plan_cache.clear()
+    
+    def prefetch_explains(self, queries: List[str], max_workers: int = EXPLAIN_WORKERS):
+        """EXPLAIN all not-yet-seen queries, spread over up to `max_workers` concurrent connections"""
+        pending = {}
+        for query in queries:
+            key = fp(query)
+            if key not in self._plan_cache and key not in pending:
+                pending[key] = query
+        if not pending:
+            return
+        keys, texts = list(pending), list(pending.values())
+        n = max(1, min(max_workers, len(keys)))
+        if n == 1:
+            self._plan_cache.update(zip(keys, run_explain_many(texts)))
+            return
+        # Round-trips are I/O bound, so threads overlap them; each worker owns one connection
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            for i, plans in enumerate(pool.map(run_explain_many, [texts[i::n] for i in range(n)])):
+                self._plan_cache.update(zip(keys[i::n], plans))
         
-    def get_explain_cost(self, query: str) -> Optional[float]:
+    def get_explain_cost(self, query: str, key: int = None) -> Optional[float]:
         """Get cost from EXPLAIN plan"""
         try:
-            explain_result = run_explain(query)
+            explain_result = self._get_plan(query, key)
             if explain_result and "Plan" in explain_result:
                 plan = explain_result["Plan"]
                 return float(plan.get("Total Cost", 0))
@@ -28,10 +153,10 @@ class CostComparator:
             print(f"⚠️ EXPLAIN failed: {e}")
         return None
     
-    def get_explain_runtime(self, query: str) -> Optional[float]:
+    def get_explain_runtime(self, query: str, key: int = None) -> Optional[float]:
         """Get actual runtime from EXPLAIN ANALYZE"""
         try:
-            explain_result = run_explain(query)
+            explain_result = self._get_plan(query, key)
             if explain_result and "Execution Time" in explain_result:
                 return float(explain_result["Execution Time"])
             elif explain_result and "Plan" in explain_result:
@@ -47,40 +172,92 @@ class CostComparator:
         """Get ML model prediction"""
         if not self.use_ml:
             return None
-            
+        
+        if query not in self._ml_cache:
+            self._ml_cache[query] = self._predict_ml(query)
+        return self._ml_cache[query]
+    
+    def _lower(self, query: str) -> str:
+        """Lowercased query text, computed once per query"""
+        lower = self._lower_cache.get(query)
+        if lower is None:
+            lower = self._lower_cache[query] = query.lower()
+        return lower
+    
+    def _features_for(self, query: str) -> dict:
+        """
+        Feature dict for a query, extracted once per exact text: whitespace and
+        case variants share a fingerprint but not query_length and friends
+        """
+        features = self._feat_cache.get(query)
+        if features is None:
+            features = self._feat_cache[query] = _extract_features(query, None)
+        return features
+    
+    def _predict_ml(self, query: str) -> Optional[float]:
         try:
-            features = extract_features(query, None)
+            features = self._features_for(query)
             
             if self.trained_features:
-                # Use specific feature order
-                feature_vector = [features.get(f, 0) for f in self.trained_features]
-                X = pd.DataFrame([feature_vector], columns=self.trained_features)
+                # Fill the preallocated row in trained feature order
+                X = self._feat_buf
+                X.fill(0)
+                for k, v in features.items():
+                    i = self._feat_index.get(k)
+                    if i is not None:
+                        X[0, i] = v
             else:
-                # Use all features
-                X = pd.DataFrame([features])
+                # Legacy model without a feature list: it needs named columns
+                import pandas as pd
+                X = pd.DataFrame([features.as_dict()])
             
-            prediction = self.model.predict(X)[0]
+            prediction = self._run_model(X)[0]
             return float(prediction) if not np.isnan(prediction) else None
             
         except Exception as e:
             print(f"⚠️ ML prediction failed: {e}")
             return None
     
-    def get_heuristic_cost(self, query: str) -> float:
+    def predict_batch(self, queries: List[str]) -> np.ndarray:
+        """ML predictions for many queries with a single predict call (NaN where unavailable)"""
+        if not self.use_ml or not queries:
+            return np.full(len(queries), np.nan)
+        
+        try:
+            rows = [self._features_for(q) for q in queries]
+            if self.trained_features:
+                X = features_to_matrix(rows, self.trained_features)
+            else:
+                import pandas as pd
+                X = pd.DataFrame([r.as_dict() for r in rows])
+            return np.asarray(self._run_model(X), dtype=float)
+        except Exception as e:
+            print(f"⚠️ ML batch prediction failed: {e}")
+            return np.full(len(queries), np.nan)
+    
+    def get_heuristic_cost(self, query: str, key: int = None) -> float:
         """Get heuristic cost (always works as fallback)"""
-        return get_query_cost(query)
+        # Same as cost_model.get_query_cost, but reuses the EXPLAIN already run for this query
+        explain_result = self._get_plan(query, key)
+        if explain_result and isinstance(explain_result, dict):
+            total_cost = explain_result.get("Plan", {}).get("Total Cost")
+            if total_cost is not None and not np.isnan(total_cost):
+                return float(total_cost)
+        return calculate_heuristic_cost(query, lower=self._lower(query))
     
-    def get_comprehensive_cost(self, query: str) -> Dict[str, float]:
-        """Get all available cost estimates for a query"""
+    def get_comprehensive_cost(self, query: str, key: int = None) -> Dict[str, float]:
+        """Get all available cost estimates for a query (assembled from the plan and ML caches)"""
+        if key is None:
+            key = fp(query)
         costs = {}
         
         # Get EXPLAIN cost (DB estimate)
-        explain_cost = self.get_explain_cost(query)
+        explain_cost = self.get_explain_cost(query, key)
         if explain_cost is not None:
             costs['db_estimate'] = explain_cost
         
         # Get EXPLAIN runtime (actual execution)
-        runtime = self.get_explain_runtime(query)
+        runtime = self.get_explain_runtime(query, key)
         if runtime is not None:
             costs['actual_runtime'] = runtime
         
@@ -90,13 +267,13 @@ class CostComparator:
             costs['ml_prediction'] = ml_cost
         
         # Always get heuristic (fallback)
-        costs['heuristic'] = self.get_heuristic_cost(query)
+        costs['heuristic'] = self.get_heuristic_cost(query, key)
         
         return costs
     
-    def get_best_cost_estimate(self, query: str) -> float:
+    def get_best_cost_estimate(self, query: str, key: int = None) -> float:
         """Get the best available cost estimate"""
-        costs = self.get_comprehensive_cost(query)
+        costs = self.get_comprehensive_cost(query, key)
         
         # Priority: actual runtime > DB estimate > ML prediction > heuristic
         if 'actual_runtime' in costs:
@@ -116,9 +293,23 @@ class CostComparator:
         print("\n🔍 COMPREHENSIVE COST ANALYSIS")
         print("=" * 60)
         
-        for name, query in all_queries:
-            costs = self.get_comprehensive_cost(query)
-            best_cost = self.get_best_cost_estimate(query)
+        # Fresh plans per comparison so stats/index changes between runs aren't masked
+        self.clear_plan_cache()
+        
+        queries = [q for _, q in all_queries]
+        keys = [fp(q) for q in queries]
+        self.prefetch_explains(queries)
+        
+        # Score every not-yet-cached candidate with one predict call
+        if self.use_ml:
+            todo = [q for q in dict.fromkeys(queries) if q not in self._ml_cache]
+            preds = self.predict_batch(todo)
+            for q, pred in zip(todo, preds):
+                self._ml_cache[q] = None if np.isnan(pred) else float(pred)
+        
+        for (name, query), key in zip(all_queries, keys):
+            costs = self.get_comprehensive_cost(query, key)
+            best_cost = self.get_best_cost_estimate(query, key)
             costs['best_estimate'] = best_cost
             
             results.append((name, query, costs))
@@ -133,8 +324,13 @@ class CostComparator:
             print(f"  📋 Heuristic: {costs['heuristic']:.2f}")
             print(f"  🎯 Best Estimate: {costs['best_estimate']:.2f}")
         
-        # Sort by best estimate
-        results.sort(key=lambda x: x[2]['best_estimate'])
+        # Sort by best estimate and compute every gap to the best in one vector op
+        costs_arr = np.fromiter((c['best_estimate'] for _, _, c in results), dtype=np.float64, count=len(results))
+        order = np.argsort(costs_arr, kind='stable')
+        results = [results[i] for i in order]
+        ranked = costs_arr[order]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct = (ranked - ranked[0]) / ranked[0] * 100
         
         print("\n🏆 RANKING (Best to Worst):")
         print("=" * 60)
@@ -142,16 +338,12 @@ class CostComparator:
         for i, (name, query, costs) in enumerate(results, 1):
             improvement = ""
             if i > 1:  # Compare to best (first result)
-                best_cost = results[0][2]['best_estimate']
-                current_cost = costs['best_estimate']
-                if current_cost > best_cost:
-                    pct_worse = ((current_cost - best_cost) / best_cost) * 100
-                    improvement = f" (+{pct_worse:.1f}% worse)"
-                elif current_cost < best_cost:
-                    pct_better = ((best_cost - current_cost) / best_cost) * 100
-                    improvement = f" (-{pct_better:.1f}% better)"
+                if pct[i - 1] > 0:
+                    improvement = f" (+{pct[i - 1]:.1f}% worse)"
+                elif pct[i - 1] < 0:
+                    improvement = f" (-{-pct[i - 1]:.1f}% better)"
             
-            print(f"{i}. {name}: {costs['best_estimate']:.2f}{improvement}")
+            print(f"{i}. {name}: {ranked[i - 1]:.2f}{improvement}")
         
         return results
 
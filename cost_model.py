@@ -1,16 +1,32 @@
 # cost_model.py
 import os
-import joblib
+import re
+from collections import Counter, deque
 import numpy as np
 from explain_runner import run_explain
+from util.model_io import load_dump
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+try:
+    import onnxruntime
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
 
 # -------------------------------
 # Load ML cost model
 # -------------------------------
 
-def load_cost_model(model_path: str = "cost_predictor.joblib"):
+def load_cost_model(model_path: str = "cost_predictor.joblib", mmap_mode=None):
     """
     Loads a trained ML model for query cost prediction.
+    Pass mmap_mode='r' to memory-map large arrays instead of reading them into RAM
+    (ignored for compressed dumps, which can't be mapped).
     Returns: (model, trained_features)
     """
     if not os.path.exists(model_path):
@@ -18,7 +34,7 @@ def load_cost_model(model_path: str = "cost_predictor.joblib"):
         return None, []
 
     try:
-        md = joblib.load(model_path)
+        md = load_dump(model_path, mmap_mode=mmap_mode)
         if isinstance(md, dict):
             model = md.get("model")
             features = md.get("features", [])
@@ -32,6 +48,44 @@ def load_cost_model(model_path: str = "cost_predictor.joblib"):
         print(f"⚠️ Failed to load ML model: {e}")
         return None, []
 
+def onnx_path_for(model_path: str) -> str:
+    """Path of the ONNX export that sits next to a joblib model."""
+    return os.path.splitext(model_path)[0] + ".onnx"
+
+def export_cost_model_onnx(model_path: str = "cost_predictor.joblib"):
+    """
+    One-time conversion of the saved model to ONNX for compiled inference.
+    Needs skl2onnx and a model saved with its feature list.
+    """
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import FloatTensorType
+
+    model, features = load_cost_model(model_path)
+    if model is None or not features:
+        print("⚠️ ONNX export needs a model saved with its feature list.")
+        return None
+    onx = convert_sklearn(model, initial_types=[("X", FloatTensorType([None, len(features)]))])
+    out_path = onnx_path_for(model_path)
+    with open(out_path, "wb") as f:
+        f.write(onx.SerializeToString())
+    print(f"✅ ONNX model written to {out_path}")
+    return out_path
+
+def load_onnx_session(model_path: str = "cost_predictor.joblib"):
+    """
+    Returns (session, input_name) for the model's ONNX export,
+    or (None, None) when onnxruntime or the export is missing.
+    """
+    onnx_path = onnx_path_for(model_path)
+    if not ONNXRUNTIME_AVAILABLE or not os.path.exists(onnx_path):
+        return None, None
+    try:
+        sess = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+        return sess, sess.get_inputs()[0].name
+    except Exception as e:
+        print(f"⚠️ Failed to load ONNX model: {e}")
+        return None, None
+
 # -------------------------------
 # Query cost estimation
 # -------------------------------
@@ -55,60 +109,155 @@ def get_query_cost(query: str) -> float:
     # Fallback to enhanced heuristic
     return calculate_heuristic_cost(query)
 
-def calculate_heuristic_cost(query: str) -> float:
-    """Enhanced heuristic cost calculation."""
-    query_lower = query.lower()
-    
-    # Table scan costs (estimated rows * scan cost)
-    table_costs = {
-        "employees": 500 * 1.0,      # 500 rows
-        "departments": 10 * 1.0,     # 10 rows  
-        "salaries": 1000 * 1.0,      # 1000 rows
-        "projects": 50 * 1.0,        # 50 rows
-        "patients": 200 * 1.0,       # 200 rows
-        "doctors": 50 * 1.0,         # 50 rows
-        "visits": 1000 * 1.0,        # 1000 rows
-        "appointments": 1000 * 1.0   # 1000 rows
-    }
+# Table scan costs (estimated rows * scan cost)
+TABLE_COSTS = {
+    "employees": 500 * 1.0,      # 500 rows
+    "departments": 10 * 1.0,     # 10 rows  
+    "salaries": 1000 * 1.0,      # 1000 rows
+    "projects": 50 * 1.0,        # 50 rows
+    "patients": 200 * 1.0,       # 200 rows
+    "doctors": 50 * 1.0,         # 50 rows
+    "visits": 1000 * 1.0,        # 1000 rows
+    "appointments": 1000 * 1.0   # 1000 rows
+}
+SELECTIVE_OPS = ("=", "between", "in (")
+RANGE_OPS = (">", "<", ">=", "<=")
+AGG_FUNCTIONS = ("count(", "sum(", "avg(", "min(", "max(")
+
+# Every substring the heuristic looks at, counted in one pass over the query
+HEURISTIC_KEYWORDS = tuple(dict.fromkeys(
+    (*TABLE_COSTS, "join", "where", *SELECTIVE_OPS, *RANGE_OPS, *AGG_FUNCTIONS,
+     "group by", "order by", "select")
+))
+
+# Zero-width lookahead so overlapping occurrences count like str.count/in did
+_KEYWORD_RE = re.compile("(?=({}))".format(
+    "|".join(re.escape(kw) for kw in sorted(HEURISTIC_KEYWORDS, key=len, reverse=True))
+))
+_SHADOWED_PREFIXES = tuple(
+    (kw, longer) for kw in HEURISTIC_KEYWORDS for longer in HEURISTIC_KEYWORDS
+    if longer != kw and longer.startswith(kw)
+)
+
+
+def _build_keyword_dfa(keywords):
+    """Aho-Corasick automaton over bytes as a dense goto table plus CSR-packed outputs."""
+    goto, outputs = [[-1] * 256], [[]]
+    for kid, kw in enumerate(keywords):
+        state = 0
+        for b in kw.encode():
+            if goto[state][b] == -1:
+                goto[state][b] = len(goto)
+                goto.append([-1] * 256)
+                outputs.append([])
+            state = goto[state][b]
+        outputs[state].append(kid)
+
+    # BFS to fill failure transitions so every (state, byte) has a target
+    fail = [0] * len(goto)
+    queue = deque()
+    for b in range(256):
+        nxt = goto[0][b]
+        if nxt == -1:
+            goto[0][b] = 0
+        else:
+            queue.append(nxt)
+    while queue:
+        state = queue.popleft()
+        outputs[state] += outputs[fail[state]]
+        for b in range(256):
+            nxt = goto[state][b]
+            if nxt == -1:
+                goto[state][b] = goto[fail[state]][b]
+            else:
+                fail[nxt] = goto[fail[state]][b]
+                queue.append(nxt)
+
+    out_ptr = np.zeros(len(goto) + 1, dtype=np.int32)
+    np.cumsum([len(o) for o in outputs], out=out_ptr[1:])
+    out_ids = np.array([k for o in outputs for k in o], dtype=np.int32)
+    return np.array(goto, dtype=np.int32), out_ptr, out_ids
+
+
+if NUMBA_AVAILABLE:
+    _KW_GOTO, _KW_OUT_PTR, _KW_OUT_IDS = _build_keyword_dfa(HEURISTIC_KEYWORDS)
+
+    @njit(cache=True)
+    def _scan_keywords(buf, goto, out_ptr, out_ids, counts):
+        state = 0
+        for b in buf:
+            state = goto[state, b]
+            for k in range(out_ptr[state], out_ptr[state + 1]):
+                counts[out_ids[k]] += 1
+
+
+def _keyword_counts(query_lower: str) -> list:
+    """Occurrence count of each HEURISTIC_KEYWORDS entry (same order) in the lowercased query."""
+    if NUMBA_AVAILABLE:
+        counts = np.zeros(len(HEURISTIC_KEYWORDS), dtype=np.int64)
+        buf = np.frombuffer(query_lower.encode(), dtype=np.uint8)
+        _scan_keywords(buf, _KW_GOTO, _KW_OUT_PTR, _KW_OUT_IDS, counts)
+        return counts.tolist()
+    counts = Counter(_KEYWORD_RE.findall(query_lower))
+    # Only the longest keyword matches at each position; credit the prefixes it shadows
+    for kw, longer in _SHADOWED_PREFIXES:
+        counts[kw] += counts[longer]
+    return [counts[kw] for kw in HEURISTIC_KEYWORDS]
+
+
+# The keyword set and table costs are fixed, so resolve every lookup the heuristic
+# makes to a position in the counts list once, at import
+_KW_POS = {kw: i for i, kw in enumerate(HEURISTIC_KEYWORDS)}
+_TABLE_TERMS = tuple((_KW_POS[table], cost) for table, cost in TABLE_COSTS.items())
+_SELECTIVE_POS = tuple(_KW_POS[op] for op in SELECTIVE_OPS)
+_RANGE_POS = tuple(_KW_POS[op] for op in RANGE_OPS)
+_AGG_POS = tuple(_KW_POS[func] for func in AGG_FUNCTIONS)
+_JOIN, _WHERE, _GROUP_BY, _ORDER_BY, _SELECT = (
+    _KW_POS[kw] for kw in ("join", "where", "group by", "order by", "select")
+)
+
+
+def calculate_heuristic_cost(query: str, lower: str = None) -> float:
+    """Enhanced heuristic cost calculation. Pass `lower` to reuse an existing query.lower()."""
+    counts = _keyword_counts(lower if lower is not None else query.lower())
     
     base_cost = 0.0
     
     # Add table scan costs
-    for table, cost in table_costs.items():
-        if table in query_lower:
+    for i, cost in _TABLE_TERMS:
+        if counts[i]:
             base_cost += cost
     
     # JOIN costs (exponential with number of joins)
-    num_joins = query_lower.count("join")
+    num_joins = counts[_JOIN]
     if num_joins > 0:
         base_cost *= (1.5 ** num_joins)  # Each join increases cost by 50%
     
     # WHERE clause selectivity
-    if "where" in query_lower:
+    if counts[_WHERE]:
         # Selective filters reduce cost
-        if any(op in query_lower for op in ["=", "between", "in ("]):
+        if any(counts[i] for i in _SELECTIVE_POS):
             base_cost *= 0.3  # Very selective
-        elif any(op in query_lower for op in [">", "<", ">=", "<="]):
+        elif any(counts[i] for i in _RANGE_POS):
             base_cost *= 0.6  # Moderately selective
         else:
             base_cost *= 0.8  # Less selective
     
     # Aggregation costs
-    agg_functions = ["count(", "sum(", "avg(", "min(", "max("]
-    for func in agg_functions:
-        if func in query_lower:
+    for i in _AGG_POS:
+        if counts[i]:
             base_cost *= 1.2
     
     # GROUP BY cost
-    if "group by" in query_lower:
+    if counts[_GROUP_BY]:
         base_cost *= 1.5
     
     # ORDER BY cost  
-    if "order by" in query_lower:
+    if counts[_ORDER_BY]:
         base_cost *= 1.3
     
     # Subquery penalty
-    subquery_count = query_lower.count("select") - 1
+    subquery_count = counts[_SELECT] - 1
     if subquery_count > 0:
         base_cost *= (2.0 ** subquery_count)
     
@@ -1,6 +1,9 @@
 import os
+import threading
+from contextlib import contextmanager
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -12,6 +15,12 @@ DB_NAME = os.getenv("DB_NAME", "sql_optimizer")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 
+POOL_MIN_CONN = 1
+POOL_MAX_CONN = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
 def get_connection():
     """Establish and return a new DB connection."""
     conn = psycopg2.connect(
@@ -23,12 +32,46 @@ def get_connection():
     )
     return conn
 
+def _get_pool():
+    """Create the shared connection pool on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    POOL_MIN_CONN, POOL_MAX_CONN,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    database=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD
+                )
+    return _pool
+
+@contextmanager
+def borrow_conn():
+    """
+    Borrow a pooled connection for the duration of a `with` block.
+    Uncommitted work is rolled back before the connection goes back to the pool.
+    """
+    pool = _get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        pool.putconn(conn, close=broken)
+
 def run_sql(query, params=None):
     """
     Run a query and return results as list of dictionaries.
     """
-    conn = get_connection()
-    try:
+    with borrow_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(query, params)
             if cur.description:  # SELECT query
@@ -37,8 +80,6 @@ def run_sql(query, params=None):
                 results = None
                 conn.commit()
         return results
-    finally:
-        conn.close()
 
 def test_connection():
     """Simple test to check DB connection."""
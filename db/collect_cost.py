@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 import psycopg2
 import sqlparse
 from dotenv import load_dotenv
@@ -35,11 +36,12 @@ engine = create_engine(DATABASE_URL)
 
 engine = create_engine(DATABASE_URL)
 
-def extract_features(query: str) -> dict:
+def extract_features(query: str, lower: str = None) -> dict:
     """
     Super basic feature extractor (can be improved later).
+    Pass `lower` to reuse an existing query.lower().
     """
-    tokens = query.lower()
+    tokens = lower if lower is not None else query.lower()
     return {
         "tables": tokens.count(" join ") + 1 if " join " in tokens else 1,
         "joins": tokens.count(" join "),
@@ -48,15 +50,31 @@ def extract_features(query: str) -> dict:
         "columns": tokens.count(",") + 1 if "select" in tokens else 0,
     }
 
-def run_explain(query: str) -> float:
+def _query_key(query: str) -> str:
+    return hashlib.sha1(" ".join(query.split()).encode("utf-8")).hexdigest()
+
+def run_explain(query: str, conn=None, cache: dict = None) -> float:
     """
     Run EXPLAIN (FORMAT JSON) and return total cost.
+    Pass `conn` to reuse an open connection across many queries, and `cache`
+    (total cost per SHA1 of whitespace-normalized SQL) to skip repeated ones.
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"))
-        plan_json = result.fetchone()[0]  # first column is JSON
-        plan = plan_json[0]  # unwrap array
-        return plan["Plan"]["Total Cost"]
+    key = _query_key(query)
+    if cache is not None and key in cache:
+        return cache[key]
+
+    if conn is None:
+        # Plain EXPLAIN never writes, so skip the BEGIN/COMMIT round-trips
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as own_conn:
+            return run_explain(query, own_conn, cache)
+
+    result = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"))
+    plan_json = result.fetchone()[0]  # first column is JSON
+    plan = plan_json[0]  # unwrap array
+    cost = plan["Plan"]["Total Cost"]
+    if cache is not None:
+        cache[key] = cost
+    return cost
 
 def collect_and_log(queries_file: str):
     """
@@ -66,11 +84,14 @@ def collect_and_log(queries_file: str):
         sql_text = f.read()
 
     queries = [q.strip() for q in sqlparse.split(sql_text) if q.strip()]
+    # Scoped to this run so costs never outlive data or index changes
+    explain_cache = {}
 
-    with engine.begin() as conn:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as explain_conn, \
+            engine.begin() as conn:
         for q in queries:
             try:
-                cost = run_explain(q)
+                cost = run_explain(q, explain_conn, explain_cache)
                 features = extract_features(q)
                 conn.execute(
                 text("INSERT INTO query_logs (query_text, features_json, db_cost) VALUES (:q, :f, :c)"),
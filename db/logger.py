@@ -1,15 +1,89 @@
 # db/logger.py
-import psycopg2
+import atexit
+import time
+from psycopg2.extras import execute_values
+from db import borrow_conn
+
+INSERT_SQL = """
+    INSERT INTO query_logs (original_query, candidate_query,
+                            predicted_cost, actual_cost, execution_time_ms)
+    VALUES %s
+"""
+
+
+class QueryLogger:
+    """
+    Buffers query_logs rows and writes them with one INSERT + commit per batch.
+    A batch is written once it reaches `batch_size` rows, or on the first log()
+    call after `flush_interval` seconds (there is no background timer).
+    Batches go over a pooled connection of their own, so the caller's `conn`
+    (which only identifies the logger) never has its transaction committed or
+    rolled back, and the atexit hook still works after the caller closed it.
+    """
+
+    def __init__(self, conn, batch_size=100, flush_interval=1.0):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._last_flush = time.monotonic()
+        atexit.register(self._flush)
+
+    def log(self, original_query, candidate_query,
+            predicted_cost, actual_cost, execution_time):
+        self._rows.append((original_query, candidate_query,
+                           predicted_cost, actual_cost, execution_time))
+        if (len(self._rows) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.flush_interval):
+            self._flush()
+
+    def close(self):
+        """Flush buffered rows and stop the atexit hook."""
+        self._flush()
+        atexit.unregister(self._flush)
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        try:
+            # borrow_conn rolls back anything left uncommitted on error
+            with borrow_conn() as conn, conn.cursor() as cur:
+                # Metrics logs can tolerate losing the last few rows on a crash;
+                # LOCAL confines that to this INSERT's transaction
+                cur.execute("SET LOCAL synchronous_commit = off")
+                execute_values(cur, INSERT_SQL, rows, page_size=self.batch_size)
+                conn.commit()
+        except Exception as e:
+            print(f"❌ Logging failed, dropped {len(rows)} rows:", e)
+
+
+_loggers = {}
+
+
+def get_logger(conn):
+    """Return the shared buffered logger for `conn`."""
+    logger = _loggers.get(id(conn))
+    if logger is None or logger.conn is not conn:
+        logger = _loggers[id(conn)] = QueryLogger(conn)
+    return logger
+
+
+def flush_logs(conn=None):
+    """Write out buffered rows (for one connection, or all of them)."""
+    for logger in ([get_logger(conn)] if conn is not None else list(_loggers.values())):
+        logger._flush()
+
+
+def close_logger(conn):
+    """Flush and forget the buffered logger for `conn`."""
+    logger = _loggers.pop(id(conn), None)
+    if logger is not None and logger.conn is conn:
+        logger.close()
+
 
 def log_query_result(conn, original_query, candidate_query,
                      predicted_cost, actual_cost, execution_time):
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO query_logs (original_query, candidate_query,
-                                        predicted_cost, actual_cost, execution_time_ms)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (original_query, candidate_query, predicted_cost, actual_cost, execution_time))
-        conn.commit()
-    except Exception as e:
-        print("❌ Logging failed:", e)
+    get_logger(conn).log(original_query, candidate_query,
+                         predicted_cost, actual_cost, execution_time)
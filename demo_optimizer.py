@@ -29,12 +29,12 @@ def demo_optimization():
     # Show original query analysis
     print("📊 ORIGINAL QUERY ANALYSIS:")
     features = extract_features(query)
-    print(f"  • Tables involved: {features['num_tables']}")
-    print(f"  • JOIN operations: {features['num_joins']}")
-    print(f"  • WHERE conditions: {features['num_conditions']}")
-    print(f"  • Query complexity: {features['query_complexity']:.1f}")
-    print(f"  • Has ORDER BY: {'Yes' if features['has_order_by'] else 'No'}")
-    print(f"  • Has BETWEEN: {'Yes' if features['has_between'] else 'No'}")
+    print(f"  • Tables involved: {features.num_tables}")
+    print(f"  • JOIN operations: {features.num_joins}")
+    print(f"  • WHERE conditions: {features.num_conditions}")
+    print(f"  • Query complexity: {features.query_complexity:.1f}")
+    print(f"  • Has ORDER BY: {'Yes' if features.has_order_by else 'No'}")
+    print(f"  • Has BETWEEN: {'Yes' if features.has_between else 'No'}")
     
     print("\n🔄 GENERATING OPTIMIZED CANDIDATES...")
     
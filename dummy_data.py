@@ -1,9 +1,13 @@
+import csv
+import io
 import psycopg2
+from psycopg2.extras import execute_values
 from faker import Faker
 import random
-from datetime import timedelta
+import numpy as np
 
 fake = Faker()
+rng = np.random.default_rng()
 
 # --------------------------------
 # DB connection
@@ -81,69 +85,97 @@ N_DOCTORS = 50
 N_VISITS = 1000
 N_APPOINTMENTS = 1000
 
+# Rows per multi-VALUES INSERT statement
+PAGE_SIZE = 1000
+
+# Distinct fake names drawn once, then sampled by index for bulk rows
+NAME_POOL_SIZE = 200
+
+# --------------------------------
+# Bulk-load helpers
+# --------------------------------
+def copy_rows(cur, table, columns, *column_values):
+    """COPY equal-length column arrays into `table` through an in-memory CSV."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(zip(*column_values))
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH CSV", buf)
+
+
+def random_dates(days_back_min, days_back_max, n):
+    """n dates between `days_back_max` and `days_back_min` days before today."""
+    today = np.datetime64('today', 'D')
+    return today - rng.integers(days_back_min, days_back_max + 1, n).astype('timedelta64[D]')
+
+
 # --------------------------------
 # Seed data
 # --------------------------------
 
 # Departments
-cur.executemany("INSERT INTO departments (dept_name) VALUES (%s);",
-                [(fake.company(),) for _ in range(N_DEPTS)])
+execute_values(cur, "INSERT INTO departments (dept_name) VALUES %s",
+               [(fake.company(),) for _ in range(N_DEPTS)], page_size=PAGE_SIZE)
 
 # Employees
-cur.executemany(
-    "INSERT INTO employees (first_name, last_name, dept_id, hire_date, salary) VALUES (%s, %s, %s, %s, %s);",
-    [(fake.first_name(), fake.last_name(),
-      random.randint(1, N_DEPTS),
-      fake.date_between(start_date='-10y', end_date='today'),
-      random.randint(30000, 150000))
-     for _ in range(N_EMPLOYEES)]
+first_names = np.array([fake.first_name() for _ in range(NAME_POOL_SIZE)], dtype=object)
+last_names = np.array([fake.last_name() for _ in range(NAME_POOL_SIZE)], dtype=object)
+copy_rows(
+    cur, "employees", ("first_name", "last_name", "dept_id", "hire_date", "salary"),
+    first_names[rng.integers(0, NAME_POOL_SIZE, N_EMPLOYEES)],
+    last_names[rng.integers(0, NAME_POOL_SIZE, N_EMPLOYEES)],
+    rng.integers(1, N_DEPTS + 1, N_EMPLOYEES),
+    random_dates(0, 3650, N_EMPLOYEES),
+    rng.integers(30000, 150001, N_EMPLOYEES)
 )
 
 # Projects
-cur.executemany(
-    "INSERT INTO projects (proj_name, dept_id, budget) VALUES (%s, %s, %s);",
+execute_values(
+    cur, "INSERT INTO projects (proj_name, dept_id, budget) VALUES %s",
     [(fake.bs(), random.randint(1, N_DEPTS), random.randint(5000, 200000))
-     for _ in range(N_PROJECTS)]
+     for _ in range(N_PROJECTS)],
+    page_size=PAGE_SIZE
 )
 
-# Salaries
-salary_rows = []
-for emp_id in range(1, N_EMPLOYEES + 1):
-    for _ in range(2):
-        from_date = fake.date_between(start_date='-5y', end_date='-1y')
-        to_date = from_date + timedelta(days=random.randint(180, 730))
-        salary_rows.append((emp_id, random.randint(30000, 150000), from_date, to_date))
-cur.executemany(
-    "INSERT INTO salaries (emp_id, amount, from_date, to_date) VALUES (%s, %s, %s, %s);",
-    salary_rows
+# Salaries (two history rows per employee)
+salary_emp_ids = np.repeat(np.arange(1, N_EMPLOYEES + 1), 2)
+n_salaries = len(salary_emp_ids)
+salary_from = random_dates(365, 5 * 365, n_salaries)
+copy_rows(
+    cur, "salaries", ("emp_id", "amount", "from_date", "to_date"),
+    salary_emp_ids,
+    rng.integers(30000, 150001, n_salaries),
+    salary_from,
+    salary_from + rng.integers(180, 731, n_salaries).astype('timedelta64[D]')
 )
 
 # Patients
-cur.executemany(
-    "INSERT INTO patients (name, dob) VALUES (%s, %s);",
+execute_values(
+    cur, "INSERT INTO patients (name, dob) VALUES %s",
     [(fake.name(), fake.date_of_birth(minimum_age=0, maximum_age=90))
-     for _ in range(N_PATIENTS)]
+     for _ in range(N_PATIENTS)],
+    page_size=PAGE_SIZE
 )
 
 # Doctors
-cur.executemany(
-    "INSERT INTO doctors (name, specialty) VALUES (%s, %s);",
-    [(fake.name(), fake.job()) for _ in range(N_DOCTORS)]
+execute_values(
+    cur, "INSERT INTO doctors (name, specialty) VALUES %s",
+    [(fake.name(), fake.job()) for _ in range(N_DOCTORS)],
+    page_size=PAGE_SIZE
 )
 
 # Visits
-cur.executemany(
-    "INSERT INTO visits (emp_id, patient_id) VALUES (%s, %s);",
-    [(random.randint(1, N_EMPLOYEES), random.randint(1, N_PATIENTS))
-     for _ in range(N_VISITS)]
+copy_rows(
+    cur, "visits", ("emp_id", "patient_id"),
+    rng.integers(1, N_EMPLOYEES + 1, N_VISITS),
+    rng.integers(1, N_PATIENTS + 1, N_VISITS)
 )
 
 # Appointments
-cur.executemany(
-    "INSERT INTO appointments (visit_id, doctor_id, appointment_date) VALUES (%s, %s, %s);",
-    [(random.randint(1, N_VISITS), random.randint(1, N_DOCTORS),
-      fake.date_between(start_date='-3y', end_date='today'))
-     for _ in range(N_APPOINTMENTS)]
+copy_rows(
+    cur, "appointments", ("visit_id", "doctor_id", "appointment_date"),
+    rng.integers(1, N_VISITS + 1, N_APPOINTMENTS),
+    rng.integers(1, N_DOCTORS + 1, N_APPOINTMENTS),
+    random_dates(0, 3 * 365, N_APPOINTMENTS)
 )
 
 conn.commit()
@@ -14,6 +14,7 @@ import sys
 import argparse
 from typing import Dict, List
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Import all the new modules
 from enhanced_rules import apply_enhanced_rules, format_suggestions
@@ -21,6 +22,9 @@ from index_recommender import IndexRecommender
 from pattern_detector import QueryPatternDetector, QueryComplexityAnalyzer
 from advanced_ml import AdvancedMLOptimizer
 
+# The four analyses per query are independent; the index one waits on the DB
+_EXEC = ThreadPoolExecutor(max_workers=4)
+
 def demonstrate_enhancements():
     """Demonstrate all the new enhancement features"""
     
@@ -57,64 +61,84 @@ def demonstrate_enhancements():
     print("🚀 SQL Query Optimizer - Advanced Features Demonstration")
     print("=" * 70)
     
+    # Build the analyzers once and reuse them for every test query
+    pattern_detector = QueryPatternDetector()
+    try:
+        index_recommender = IndexRecommender()
+        index_error = None
+    except Exception as e:
+        index_recommender = None
+        index_error = e
+    
     for i, query in enumerate(test_queries, 1):
-        print(f"\n{'='*20} TEST QUERY {i} {'='*20}")
-        print("Query:", query.strip()[:100] + "..." if len(query.strip()) > 100 else query.strip())
-        print()
+        # Start every analysis up front, then report them in order
+        rules_future = _EXEC.submit(apply_enhanced_rules, query)
+        index_future = (_EXEC.submit(index_recommender.generate_report, query)
+                        if index_recommender is not None else None)
+        pattern_future = _EXEC.submit(pattern_detector.generate_pattern_report, query)
+        complexity_future = _EXEC.submit(QueryComplexityAnalyzer.calculate_complexity_score, query)
+        
+        # Collect the whole section and write it in one go
+        out = []
+        emit = out.append
+        emit(f"\n{'='*20} TEST QUERY {i} {'='*20}")
+        emit("Query: " + (query.strip()[:100] + "..." if len(query.strip()) > 100 else query.strip()))
+        emit("")
         
         # 1. Enhanced Rule-Based Analysis
-        print("🔧 ENHANCED RULE-BASED ANALYSIS:")
-        print("-" * 40)
-        enhanced_suggestions = apply_enhanced_rules(query)
+        emit("🔧 ENHANCED RULE-BASED ANALYSIS:")
+        emit("-" * 40)
+        enhanced_suggestions = rules_future.result()
         if enhanced_suggestions:
-            print(format_suggestions(enhanced_suggestions))
+            emit(format_suggestions(enhanced_suggestions))
         else:
-            print("✅ No rule-based suggestions")
+            emit("✅ No rule-based suggestions")
         
         # 2. Index Recommendations
-        print("\n📊 INDEX RECOMMENDATIONS:")
-        print("-" * 30)
+        emit("\n📊 INDEX RECOMMENDATIONS:")
+        emit("-" * 30)
         try:
-            index_recommender = IndexRecommender()
-            index_report = index_recommender.generate_report(query)
-            print(index_report)
+            if index_recommender is None:
+                raise index_error
+            index_report = index_future.result()
+            emit(index_report)
         except Exception as e:
-            print(f"Index analysis error: {e}")
+            emit(f"Index analysis error: {e}")
         
         # 3. Pattern Detection
-        print("\n🔍 PATTERN DETECTION:")
-        print("-" * 20)
+        emit("\n🔍 PATTERN DETECTION:")
+        emit("-" * 20)
         try:
-            pattern_detector = QueryPatternDetector()
-            pattern_report = pattern_detector.generate_pattern_report(query)
-            print(pattern_report)
+            pattern_report = pattern_future.result()
+            emit(pattern_report)
         except Exception as e:
-            print(f"Pattern detection error: {e}")
+            emit(f"Pattern detection error: {e}")
         
         # 4. Complexity Analysis
-        print("\n📈 COMPLEXITY ANALYSIS:")
-        print("-" * 25)
+        emit("\n📈 COMPLEXITY ANALYSIS:")
+        emit("-" * 25)
         try:
-            complexity_metrics = QueryComplexityAnalyzer.calculate_complexity_score(query)
+            complexity_metrics = complexity_future.result()
             
-            print(f"Complexity Level: {complexity_metrics['complexity_level']}")
-            print(f"Overall Score: {complexity_metrics['overall_score']}/100")
-            print(f"Query Length: {complexity_metrics['basic_metrics']['length']} characters")
-            print(f"Number of JOINs: {complexity_metrics['structural_complexity']['num_joins']}")
-            print(f"Number of Subqueries: {complexity_metrics['structural_complexity']['num_subqueries']}")
-            print(f"Max Nesting Depth: {complexity_metrics['structural_complexity']['max_nesting_depth']}")
+            emit(f"Complexity Level: {complexity_metrics['complexity_level']}")
+            emit(f"Overall Score: {complexity_metrics['overall_score']}/100")
+            emit(f"Query Length: {complexity_metrics['basic_metrics']['length']} characters")
+            emit(f"Number of JOINs: {complexity_metrics['structural_complexity']['num_joins']}")
+            emit(f"Number of Subqueries: {complexity_metrics['structural_complexity']['num_subqueries']}")
+            emit(f"Max Nesting Depth: {complexity_metrics['structural_complexity']['max_nesting_depth']}")
             
             if complexity_metrics['operation_complexity']['has_aggregates']:
-                print("⚡ Contains aggregate functions")
+                emit("⚡ Contains aggregate functions")
             if complexity_metrics['operation_complexity']['has_window_functions']:
-                print("🪟 Contains window functions")
+                emit("🪟 Contains window functions")
             if complexity_metrics['operation_complexity']['has_cte']:
-                print("🔗 Uses Common Table Expressions")
+                emit("🔗 Uses Common Table Expressions")
                 
         except Exception as e:
-            print(f"Complexity analysis error: {e}")
+            emit(f"Complexity analysis error: {e}")
         
-        print("\n" + "="*70)
+        emit("\n" + "="*70)
+        sys.stdout.write("\n".join(out) + "\n")
 
 def interactive_analysis():
     """Interactive query analysis mode"""
@@ -141,36 +165,39 @@ def interactive_analysis():
         if not query:
             continue
             
-        print(f"\n🔍 Analyzing query: {query[:50]}...")
+        out = []
+        emit = out.append
+        emit(f"\n🔍 Analyzing query: {query[:50]}...")
         start_time = time.time()
         
         # Enhanced rules analysis
-        print("\n📋 OPTIMIZATION SUGGESTIONS:")
+        emit("\n📋 OPTIMIZATION SUGGESTIONS:")
         suggestions = apply_enhanced_rules(query)
         if suggestions:
             for suggestion in suggestions:
                 priority_emoji = {"CRITICAL": "🚨", "HIGH": "⚠️", "MEDIUM": "📋", "LOW": "💡"}
-                emoji = priority_emoji.get(suggestion['priority'], "📋")
-                print(f"{emoji} [{suggestion['priority']}] {suggestion['suggestion']}")
+                emoji = priority_emoji.get(suggestion.priority, "📋")
+                emit(f"{emoji} [{suggestion.priority}] {suggestion.suggestion}")
         else:
-            print("✅ No immediate suggestions")
+            emit("✅ No immediate suggestions")
         
         # Quick pattern check
-        print("\n🔍 PATTERN ANALYSIS:")
+        emit("\n🔍 PATTERN ANALYSIS:")
         patterns = pattern_detector.analyze_query(query)
         if patterns:
             for pattern in patterns[:3]:  # Show top 3
-                print(f"⚠️ {pattern.description} (confidence: {pattern.confidence:.1%})")
+                emit(f"⚠️ {pattern.description} (confidence: {pattern.confidence:.1%})")
         else:
-            print("✅ No problematic patterns detected")
+            emit("✅ No problematic patterns detected")
         
         # Quick complexity check
-        print("\n📊 COMPLEXITY:")
+        emit("\n📊 COMPLEXITY:")
         complexity = QueryComplexityAnalyzer.calculate_complexity_score(query)
-        print(f"Level: {complexity['complexity_level']} (Score: {complexity['overall_score']}/100)")
+        emit(f"Level: {complexity['complexity_level']} (Score: {complexity['overall_score']}/100)")
         
         analysis_time = time.time() - start_time
-        print(f"\n⏱️ Analysis completed in {analysis_time:.3f} seconds")
+        emit(f"\n⏱️ Analysis completed in {analysis_time:.3f} seconds")
+        sys.stdout.write("\n".join(out) + "\n")
 
 def main():
     """Main function with command-line interface"""
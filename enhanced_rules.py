@@ -1,162 +1,275 @@
 import re
-import sqlparse
-from typing import List, Dict, Any
+from collections import Counter, defaultdict, namedtuple
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Dict, Tuple
+from sqlparse.tokens import DML, Keyword, Operator, Wildcard
+from ml_optimizer._sqlparse_cache import parse_cached
 
-def apply_enhanced_rules(query: str) -> List[Dict[str, Any]]:
+# Every pattern the rules look for, as one alternation so a single finditer
+# pass over the query feeds all of them
+_RULE_SCAN_RE = re.compile(
+    r"where\s+(?P<where_col>\w+)\s*[><=!]"
+    r"|join\s+\w+\s+\w+\s+on\s+(?:\w+\.)?(?P<join_col>\w+)\s*="
+    r"|like\s+'(?P<like>[^']+)'"
+    r"|(?P<in_subquery>\bin\s*\(\s*select\b)"
+)
+
+# Keyword presence bits, set during the token pass so rules can skip dead branches
+WHERE_BIT = 1 << 0
+JOIN_BIT = 1 << 1
+ORDER_BIT = 1 << 2
+LIMIT_BIT = 1 << 3
+DISTINCT_BIT = 1 << 4
+OR_BIT = 1 << 5
+LIKE_BIT = 1 << 6
+IN_BIT = 1 << 7
+UNION_BIT = 1 << 8
+ALL_BITS = (1 << 9) - 1
+
+_KEYWORD_BITS = {
+    "where": WHERE_BIT, "order by": ORDER_BIT, "limit": LIMIT_BIT,
+    "distinct": DISTINCT_BIT, "or": OR_BIT, "in": IN_BIT,
+    "union": UNION_BIT, "union all": UNION_BIT,
+}
+# Only run the regex scan when one of its patterns can possibly match
+_SCAN_BITS = WHERE_BIT | JOIN_BIT | LIKE_BIT | IN_BIT
+
+PreprocessedQuery = namedtuple(
+    "PreprocessedQuery",
+    ["lower", "statement", "where_cols", "join_cols", "like_patterns",
+     "in_subquery", "counts", "select_star", "mask"]
+)
+
+@dataclass(slots=True, frozen=True)
+class Suggestion:
+    rule: str
+    priority: str
+    issue: str
+    suggestion: str
+    example: str = ""
+    impact: str = ""
+    columns: Tuple[str, ...] = ()
+    join_count: int = 0
+    pattern: str = ""
+
+def _scan_rules(q: str) -> Dict[str, list]:
+    """Group every _RULE_SCAN_RE hit in the lowercased query by pattern name"""
+    hits = {"where_col": [], "join_col": [], "like": [], "in_subquery": []}
+    for m in _RULE_SCAN_RE.finditer(q):
+        kind = m.lastgroup
+        hits[kind].append(m.group(kind))
+    return hits
+
+_NO_HITS = {"where_col": (), "join_col": (), "like": (), "in_subquery": ()}
+
+def _keyword_counts(tokens):
     """
-    Enhanced rule-based optimizer with more sophisticated analysis
-    Returns structured suggestions with priority levels and specific improvements
+    Single pass over the flattened tokens: a Counter of lowercased keywords
+    (multi-word ones like 'order by' with whitespace collapsed), whether a
+    wildcard directly follows SELECT, and the keyword presence bitmask.
+    """
+    counts = Counter()
+    select_star = False
+    mask = 0
+    prev = None
+    for t in tokens:
+        if t.is_whitespace:
+            continue
+        if t.ttype in Keyword:
+            kw = " ".join(t.value.lower().split())
+            counts[kw] += 1
+            mask |= JOIN_BIT if kw.endswith("join") else _KEYWORD_BITS.get(kw, 0)
+        elif t.ttype in Operator.Comparison and t.value[:1].isalpha():
+            # Word operators (LIKE, ILIKE, and IN in newer sqlparse) count as keywords too
+            op = " ".join(t.value.lower().split())
+            counts[op] += 1
+            mask |= LIKE_BIT if "like" in op else IN_BIT if op.endswith("in") else 0
+        elif t.ttype in Wildcard and prev is not None and prev.ttype is DML \
+                and prev.normalized == "SELECT":
+            select_star = True
+        prev = t
+    # Every JOIN flavour ('left join', 'inner join', ...) counts as a join
+    counts["join"] = sum(n for kw, n in counts.items() if kw.endswith("join"))
+    return counts, select_star, mask
+
+@lru_cache(maxsize=512)
+def preprocess_query(query: str) -> PreprocessedQuery:
+    """
+    Parse and lowercase a query once, shared by the rule engine, index recommender
+    and complexity analyzer. Results are cached, so treat them as read-only.
     """
-    suggestions = []
     q = query.lower().strip()
-    
-    # Parse SQL for better analysis
+
     try:
-        parsed = sqlparse.parse(query)[0]
-        tokens = list(parsed.flatten())
-    except:
-        tokens = []
+        statement = parse_cached(query)
+        # Stream the leaves straight into the counter rather than materializing them
+        counts, select_star, mask = _keyword_counts(statement.flatten())
+    except Exception:
+        statement = None
+        # Without tokens nothing can be ruled out
+        counts, select_star, mask = Counter(), False, ALL_BITS
+
+    hits = _scan_rules(q) if mask & _SCAN_BITS else _NO_HITS
+
+    return PreprocessedQuery(
+        lower=q,
+        statement=statement,
+        where_cols=tuple(hits["where_col"]),
+        join_cols=tuple(hits["join_col"]),
+        like_patterns=tuple(hits["like"]),
+        in_subquery=bool(hits["in_subquery"]),
+        counts=counts,
+        select_star=select_star,
+        mask=mask,
+    )
+
+@lru_cache(maxsize=1024)
+def apply_enhanced_rules(query: str) -> Tuple[Suggestion, ...]:
+    """
+    Enhanced rule-based optimizer with more sophisticated analysis
+    Returns structured suggestions with priority levels and specific improvements,
+    memoized per query as immutable Suggestion records
+    """
+    suggestions = []
+    pre = preprocess_query(query)
 
     # CRITICAL ISSUES (High Priority)
     
     # 1. SELECT * detection with specific column suggestions
-    if "select *" in q:
-        suggestions.append({
-            "rule": "avoid_select_star",
-            "priority": "HIGH",
-            "issue": "SELECT * retrieves all columns",
-            "suggestion": "Specify only required columns to reduce I/O and network traffic",
-            "example": "SELECT id, name, email FROM users WHERE...",
-            "impact": "Can improve performance by 20-50% for wide tables"
-        })
+    if pre.select_star:
+        suggestions.append(Suggestion(
+            rule="avoid_select_star",
+            priority="HIGH",
+            issue="SELECT * retrieves all columns",
+            suggestion="Specify only required columns to reduce I/O and network traffic",
+            example="SELECT id, name, email FROM users WHERE...",
+            impact="Can improve performance by 20-50% for wide tables"
+        ))
 
     # 2. Missing indexes detection
-    where_patterns = re.findall(r'where\s+(\w+)\s*[><=!]', q)
-    join_patterns = re.findall(r'join\s+\w+\s+\w+\s+on\s+(\w+\.)?(\w+)\s*=', q)
-    
-    if where_patterns or join_patterns:
-        columns = set(where_patterns + [col for _, col in join_patterns])
-        suggestions.append({
-            "rule": "index_recommendation",
-            "priority": "HIGH",
-            "issue": f"Potential missing indexes on columns: {', '.join(columns)}",
-            "suggestion": f"Consider creating indexes: CREATE INDEX idx_column ON table(column)",
-            "columns": list(columns),
-            "impact": "Can improve query performance by 10-1000x"
-        })
+    if pre.where_cols or pre.join_cols:
+        columns = set(pre.where_cols + pre.join_cols)
+        suggestions.append(Suggestion(
+            rule="index_recommendation",
+            priority="HIGH",
+            issue=f"Potential missing indexes on columns: {', '.join(columns)}",
+            suggestion=f"Consider creating indexes: CREATE INDEX idx_column ON table(column)",
+            columns=tuple(columns),
+            impact="Can improve query performance by 10-1000x"
+        ))
 
     # 3. N+1 query pattern detection
-    if "select" in q and " in (" in q and "select" in q[q.find(" in ("):]:
-        suggestions.append({
-            "rule": "n_plus_one_query",
-            "priority": "CRITICAL",
-            "issue": "Potential N+1 query pattern detected",
-            "suggestion": "Replace subquery with JOIN for better performance",
-            "example": "SELECT ... FROM table1 t1 JOIN table2 t2 ON t1.id = t2.foreign_id",
-            "impact": "Can reduce query count from N+1 to 1"
-        })
+    if pre.in_subquery:
+        suggestions.append(Suggestion(
+            rule="n_plus_one_query",
+            priority="CRITICAL",
+            issue="Potential N+1 query pattern detected",
+            suggestion="Replace subquery with JOIN for better performance",
+            example="SELECT ... FROM table1 t1 JOIN table2 t2 ON t1.id = t2.foreign_id",
+            impact="Can reduce query count from N+1 to 1"
+        ))
 
     # MEDIUM PRIORITY OPTIMIZATIONS
 
     # 4. JOIN order optimization
-    join_count = q.count(" join ")
+    join_count = pre.counts["join"] if pre.mask & JOIN_BIT else 0
     if join_count > 2:
-        suggestions.append({
-            "rule": "join_order",
-            "priority": "MEDIUM",
-            "issue": f"Query has {join_count} joins",
-            "suggestion": "Ensure smallest tables are joined first, add appropriate WHERE filters early",
-            "join_count": join_count,
-            "impact": "Can improve performance by 10-30%"
-        })
+        suggestions.append(Suggestion(
+            rule="join_order",
+            priority="MEDIUM",
+            issue=f"Query has {join_count} joins",
+            suggestion="Ensure smallest tables are joined first, add appropriate WHERE filters early",
+            join_count=join_count,
+            impact="Can improve performance by 10-30%"
+        ))
 
     # 5. LIMIT without ORDER BY
-    if "limit" in q and "order by" not in q:
-        suggestions.append({
-            "rule": "limit_without_order",
-            "priority": "MEDIUM",
-            "issue": "LIMIT without ORDER BY returns unpredictable results",
-            "suggestion": "Add ORDER BY clause to ensure consistent results",
-            "example": "... ORDER BY id LIMIT 10",
-            "impact": "Ensures deterministic query results"
-        })
+    if pre.mask & (LIMIT_BIT | ORDER_BIT) == LIMIT_BIT:
+        suggestions.append(Suggestion(
+            rule="limit_without_order",
+            priority="MEDIUM",
+            issue="LIMIT without ORDER BY returns unpredictable results",
+            suggestion="Add ORDER BY clause to ensure consistent results",
+            example="... ORDER BY id LIMIT 10",
+            impact="Ensures deterministic query results"
+        ))
 
     # 6. Inefficient LIKE patterns
-    like_patterns = re.findall(r"like\s+'([^']+)'", q)
-    for pattern in like_patterns:
+    for pattern in (pre.like_patterns if pre.mask & LIKE_BIT else ()):
         if pattern.startswith('%'):
-            suggestions.append({
-                "rule": "inefficient_like",
-                "priority": "MEDIUM",
-                "issue": f"LIKE pattern '{pattern}' prevents index usage",
-                "suggestion": "Consider full-text search or restructuring the query",
-                "pattern": pattern,
-                "impact": "May cause full table scan"
-            })
+            suggestions.append(Suggestion(
+                rule="inefficient_like",
+                priority="MEDIUM",
+                issue=f"LIKE pattern '{pattern}' prevents index usage",
+                suggestion="Consider full-text search or restructuring the query",
+                pattern=pattern,
+                impact="May cause full table scan"
+            ))
 
     # LOW PRIORITY SUGGESTIONS
 
     # 7. DISTINCT without necessity
-    if " distinct " in q:
-        suggestions.append({
-            "rule": "unnecessary_distinct",
-            "priority": "LOW",
-            "issue": "DISTINCT clause detected",
-            "suggestion": "Verify if DISTINCT is necessary; consider using EXISTS or proper JOINs",
-            "impact": "DISTINCT can be expensive on large result sets"
-        })
+    if pre.mask & DISTINCT_BIT:
+        suggestions.append(Suggestion(
+            rule="unnecessary_distinct",
+            priority="LOW",
+            issue="DISTINCT clause detected",
+            suggestion="Verify if DISTINCT is necessary; consider using EXISTS or proper JOINs",
+            impact="DISTINCT can be expensive on large result sets"
+        ))
 
     # 8. ORDER BY without LIMIT on large tables
-    if "order by" in q and "limit" not in q:
-        suggestions.append({
-            "rule": "order_without_limit",
-            "priority": "LOW",
-            "issue": "ORDER BY without LIMIT sorts entire result set",
-            "suggestion": "Consider adding LIMIT if you don't need all results",
-            "impact": "Can save significant CPU and memory on large datasets"
-        })
+    if pre.mask & (LIMIT_BIT | ORDER_BIT) == ORDER_BIT:
+        suggestions.append(Suggestion(
+            rule="order_without_limit",
+            priority="LOW",
+            issue="ORDER BY without LIMIT sorts entire result set",
+            suggestion="Consider adding LIMIT if you don't need all results",
+            impact="Can save significant CPU and memory on large datasets"
+        ))
 
     # 9. OR conditions optimization
-    or_count = q.count(" or ")
+    or_count = pre.counts["or"] if pre.mask & OR_BIT else 0
     if or_count > 2:
-        suggestions.append({
-            "rule": "multiple_or_conditions",
-            "priority": "LOW",
-            "issue": f"Query contains {or_count} OR conditions",
-            "suggestion": "Consider using IN clause or UNION for better performance",
-            "example": "WHERE column IN (val1, val2, val3) instead of column = val1 OR column = val2 OR column = val3",
-            "impact": "Can improve index usage and performance"
-        })
-
-    return suggestions
-
-def format_suggestions(suggestions: List[Dict[str, Any]]) -> str:
+        suggestions.append(Suggestion(
+            rule="multiple_or_conditions",
+            priority="LOW",
+            issue=f"Query contains {or_count} OR conditions",
+            suggestion="Consider using IN clause or UNION for better performance",
+            example="WHERE column IN (val1, val2, val3) instead of column = val1 OR column = val2 OR column = val3",
+            impact="Can improve index usage and performance"
+        ))
+
+    return tuple(suggestions)
+
+def format_suggestions(suggestions: Tuple[Suggestion, ...]) -> str:
     """Format suggestions for display"""
     if not suggestions:
         return "✅ No optimization suggestions - query looks good!"
     
     output = []
     
-    # Group by priority
-    critical = [s for s in suggestions if s['priority'] == 'CRITICAL']
-    high = [s for s in suggestions if s['priority'] == 'HIGH'] 
-    medium = [s for s in suggestions if s['priority'] == 'MEDIUM']
-    low = [s for s in suggestions if s['priority'] == 'LOW']
+    # Group by priority in one pass
+    by_priority = defaultdict(list)
+    for s in suggestions:
+        by_priority[s.priority].append(s)
     
-    for priority, items, emoji in [
-        ("CRITICAL", critical, "🚨"),
-        ("HIGH", high, "⚠️"),
-        ("MEDIUM", medium, "📋"),
-        ("LOW", low, "💡")
+    for priority, emoji in [
+        ("CRITICAL", "🚨"),
+        ("HIGH", "⚠️"),
+        ("MEDIUM", "📋"),
+        ("LOW", "💡")
     ]:
+        items = by_priority.get(priority)
         if items:
             output.append(f"\n{emoji} {priority} PRIORITY:")
             for item in items:
-                output.append(f"  • {item['issue']}")
-                output.append(f"    💡 {item['suggestion']}")
-                if 'example' in item:
-                    output.append(f"    📝 Example: {item['example']}")
-                output.append(f"    📊 Impact: {item['impact']}")
+                output.append(f"  • {item.issue}")
+                output.append(f"    💡 {item.suggestion}")
+                if item.example:
+                    output.append(f"    📝 Example: {item.example}")
+                output.append(f"    📊 Impact: {item.impact}")
                 output.append("")
     
     return "\n".join(output)
@@ -165,4 +278,4 @@ def format_suggestions(suggestions: List[Dict[str, Any]]) -> str:
 def apply_rules(query: str) -> List[str]:
     """Original function for backward compatibility"""
     enhanced = apply_enhanced_rules(query)
-    return [s['suggestion'] for s in enhanced]
\ No newline at end of file
+    return [s.suggestion for s in enhanced]
\ No newline at end of file
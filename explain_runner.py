@@ -1,4 +1,5 @@
-from db import run_sql
+from psycopg2.extras import RealDictCursor
+from db import borrow_conn
 
 def run_explain(query):
     """
@@ -6,15 +7,46 @@ def run_explain(query):
     """
     explain_query = f"EXPLAIN (ANALYZE, FORMAT JSON) {query}"
     try:
-        result = run_sql(explain_query)
-        if result:
+        # Plain tuple cursor and a single fetchone: the plan arrives as one row,
+        # so skip building a result list of dict rows around it
+        with borrow_conn() as conn, conn.cursor() as cur:
+            cur.execute(explain_query)
+            row = cur.fetchone()
+        if row:
             # PostgreSQL returns JSON in first row, first column
-            return result[0]['QUERY PLAN'][0]
+            return row[0][0]
         return None
     except Exception as e:
         print("❌ EXPLAIN failed:", e)
         return None
 
+def run_explain_many(queries):
+    """
+    Run EXPLAIN (ANALYZE, FORMAT JSON) for several queries over one connection.
+    Returns a list aligned with `queries` (None where EXPLAIN failed).
+    """
+    plans = []
+    try:
+        with borrow_conn() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+            for query in queries:
+                # Savepoint per query so one failure doesn't abort the rest of the batch
+                cur.execute("SAVEPOINT explain_many")
+                try:
+                    cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}")
+                    row = cur.fetchone()
+                    plans.append(row['QUERY PLAN'][0] if row else None)
+                    cur.execute("RELEASE SAVEPOINT explain_many")
+                except Exception as e:
+                    print("❌ EXPLAIN failed:", e)
+                    cur.execute("ROLLBACK TO SAVEPOINT explain_many")
+                    plans.append(None)
+            # ANALYZE executed the statements; never keep their side effects
+            conn.rollback()
+    except Exception as e:
+        print("❌ EXPLAIN failed:", e)
+        plans += [None] * (len(queries) - len(plans))
+    return plans
+
 # Test block
 if __name__ == "__main__":
     test_query = """
@@ -1,16 +1,78 @@
 import re
+import time
+import weakref
 import psycopg2
-from typing import List, Dict, Set
-from db import get_connection
+from collections import Counter
+from typing import List, Dict, Set, Tuple
+from sqlparse.sql import Comparison, Identifier, IdentifierList, Parenthesis, Where
+from sqlparse.tokens import DML, Keyword
+from db import borrow_conn
+from enhanced_rules import preprocess_query
+
+_INDEX_COLUMNS_RE = re.compile(r'\(([^)]+)\)')
+_EMPTY = frozenset()
+
+# Seconds a fetched pg_indexes snapshot is reused before re-querying
+INDEX_CACHE_TTL = 60
+
+# Memoized analyze_query results kept per recommender
+ANALYSIS_CACHE_SIZE = 1024
+
+# Report marker per priority (0-10): green below 6, yellow 6-7, red 8+
+_PRIO_EMOJI = tuple('🟢' * 6 + '🟡' * 2 + '🔴' * 3)
+
+# Report templates; a trailing newline stands in for the blank separator line
+_TMPL_ANALYSIS = (
+    "\n🔍 Query Complexity Score: {complexity_score}\n"
+    "   • WHERE columns: {where_columns}\n"
+    "   • JOIN columns: {join_columns}\n"
+    "   • ORDER BY columns: {order_columns}"
+)
+_TMPL_IDX = "   {emoji} Priority {priority}: {table}.{column}\n      Reason: {reason}\n      SQL: {sql}\n"
+_TMPL_COMPOSITE = "   • {table}: {column_list}\n     SQL: {sql}\n"
+
+# Server-side prepared statement for the pg_indexes lookup
+_INDEX_STMT = "get_idx"
+_INDEX_SQL = """
+    SELECT 
+        schemaname, tablename, indexname, indexdef
+    FROM pg_indexes 
+    WHERE schemaname = 'public'
+"""
 
 class IndexRecommender:
     """Intelligent index recommendation system"""
     
+    # Pooled connections that already hold the prepared index lookup
+    _prepared_on = weakref.WeakSet()
+    
     def __init__(self):
-        self.connection = get_connection()
+        self._idx_cache = None
+        self._idx_cache_ts = 0
+        self._indexed_columns = {}
+        self._analysis_cache = {}
+    
+    def refresh(self):
+        """Drop the cached index list so the next analysis re-reads pg_indexes"""
+        self._idx_cache = None
+        self._idx_cache_ts = 0
+        self._analysis_cache.clear()
     
     def analyze_query(self, query: str) -> Dict:
-        """Analyze query and recommend indexes"""
+        """
+        Analyze query and recommend indexes. Results are memoized per query
+        until the index snapshot is refreshed, so treat them as read-only.
+        """
+        # Refresh the existing index snapshot if it has expired; a new
+        # snapshot invalidates every memoized analysis
+        snapshot_ts = self._idx_cache_ts
+        self._get_existing_indexes()
+        if self._idx_cache_ts != snapshot_ts or len(self._analysis_cache) >= ANALYSIS_CACHE_SIZE:
+            self._analysis_cache.clear()
+        cached = self._analysis_cache.get(query)
+        if cached is not None:
+            return cached
+        
         recommendations = {
             'missing_indexes': [],
             'unused_indexes': [],
@@ -18,28 +80,25 @@ class IndexRecommender:
             'query_analysis': {}
         }
         
-        # Extract WHERE columns
-        where_columns = self._extract_where_columns(query)
+        pre = preprocess_query(query)
         
-        # Extract JOIN columns
-        join_columns = self._extract_join_columns(query)
+        # Extract WHERE, JOIN and ORDER BY columns
+        where_columns, join_columns, order_columns = self._extract_columns(pre.statement)
         
-        # Extract ORDER BY columns
-        order_columns = self._extract_order_columns(query)
-        
-        # Get existing indexes
-        existing_indexes = self._get_existing_indexes()
+        # Clause presence is the same for every candidate column
+        kw = pre.counts
+        clauses = (kw['where'] > 0, kw['join'] > 0, kw['order by'] > 0)
         
         # Analyze missing single-column indexes
         all_filtered_columns = where_columns | join_columns | order_columns
         for table, column in all_filtered_columns:
-            if not self._has_index(existing_indexes, table, column):
+            if not self._has_index(table, column):
                 recommendations['missing_indexes'].append({
                     'table': table,
                     'column': column,
                     'type': 'single',
-                    'reason': self._get_index_reason(table, column, query),
-                    'priority': self._calculate_priority(table, column, query),
+                    'reason': self._get_index_reason(column, pre.lower, clauses),
+                    'priority': self._calculate_priority(column, pre.lower, clauses),
                     'sql': f"CREATE INDEX idx_{table}_{column} ON {table} ({column});"
                 })
         
@@ -60,140 +119,161 @@ class IndexRecommender:
             'where_columns': len(where_columns),
             'join_columns': len(join_columns),
             'order_columns': len(order_columns),
-            'complexity_score': self._calculate_complexity(query)
+            'complexity_score': self._calculate_complexity(kw)
         }
         
+        self._analysis_cache[query] = recommendations
         return recommendations
     
-    def _extract_where_columns(self, query: str) -> Set[tuple]:
-        """Extract table.column pairs from WHERE clauses"""
-        columns = set()
-        
-        # Pattern for WHERE conditions: table.column operator value
-        pattern = r'WHERE\s+(?:.*?\s+)?(\w+)\.(\w+)\s*[<>=!]'
-        matches = re.findall(pattern, query, re.IGNORECASE)
-        
-        # Also check for simple column references (assume main table)
-        simple_pattern = r'WHERE\s+(?:.*?\s+)?(\w+)\s*[<>=!]'
-        simple_matches = re.findall(simple_pattern, query, re.IGNORECASE)
-        
-        for match in matches:
-            columns.add((match[0], match[1]))
-        
-        # For simple columns, try to infer table from FROM clause
-        from_match = re.search(r'FROM\s+(\w+)', query, re.IGNORECASE)
-        if from_match and simple_matches:
-            main_table = from_match.group(1)
-            for col in simple_matches:
-                if '.' not in col:  # Simple column reference
-                    columns.add((main_table, col))
-        
-        return columns
+    def _extract_columns(self, statement) -> Tuple[Set[tuple], Set[tuple], Set[tuple]]:
+        """
+        Extract (table, column) pairs used in WHERE, JOIN ... ON and ORDER BY
+        in one walk over the parsed statement. Unqualified columns are
+        attributed to the main FROM table.
+        """
+        where_columns, join_columns, order_columns = set(), set(), set()
+        if statement is None:
+            return where_columns, join_columns, order_columns
+        
+        main_table = None
+        tokens = [t for t in statement.tokens if not t.is_whitespace]
+        for i, token in enumerate(tokens):
+            nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+            
+            if isinstance(token, Where):
+                for comparison in self._iter_comparisons(token):
+                    pair = self._column_ref(comparison.left, main_table)
+                    if pair:
+                        where_columns.add(pair)
+            
+            elif token.ttype in Keyword and nxt is not None:
+                keyword = ' '.join(token.normalized.split())
+                
+                if keyword == 'FROM' and main_table is None and isinstance(nxt, Identifier):
+                    main_table = nxt.get_real_name()
+                
+                elif keyword == 'ON':
+                    # Collect every `a.x = b.y` up to the next non-AND keyword
+                    for cond in tokens[i + 1:]:
+                        if isinstance(cond, Comparison):
+                            for side in (cond.left, cond.right):
+                                if isinstance(side, Identifier) and side.get_parent_name():
+                                    join_columns.add((side.get_parent_name(), side.get_real_name()))
+                        elif not (cond.ttype in Keyword and cond.normalized == 'AND'):
+                            break
+                
+                elif keyword == 'ORDER BY':
+                    if isinstance(nxt, IdentifierList):
+                        items = nxt.get_identifiers()
+                    else:
+                        items = [nxt]
+                    for item in items:
+                        pair = self._column_ref(item, main_table)
+                        if pair:
+                            order_columns.add(pair)
+        
+        return where_columns, join_columns, order_columns
     
-    def _extract_join_columns(self, query: str) -> Set[tuple]:
-        """Extract columns used in JOIN conditions"""
-        columns = set()
-        
-        # Pattern for JOIN conditions: table1.col1 = table2.col2
-        pattern = r'JOIN\s+(\w+)\s+\w+\s+ON\s+(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)'
-        matches = re.findall(pattern, query, re.IGNORECASE)
-        
-        for match in matches:
-            # match: (join_table, table1, col1, table2, col2)
-            columns.add((match[1], match[2]))  # Left side
-            columns.add((match[3], match[4]))  # Right side
-        
-        return columns
+    @staticmethod
+    def _iter_comparisons(group):
+        """Comparisons in a WHERE clause, including parenthesised ones but not subqueries"""
+        for token in group.tokens:
+            if isinstance(token, Comparison):
+                yield token
+            elif isinstance(token, Parenthesis) and not any(t.ttype is DML for t in token.tokens):
+                yield from IndexRecommender._iter_comparisons(token)
     
-    def _extract_order_columns(self, query: str) -> Set[tuple]:
-        """Extract columns from ORDER BY clause"""
-        columns = set()
-        
-        pattern = r'ORDER\s+BY\s+([\w\.,\s]+)'
-        match = re.search(pattern, query, re.IGNORECASE)
-        
-        if match:
-            order_clause = match.group(1)
-            # Split by comma and extract table.column
-            for item in order_clause.split(','):
-                item = item.strip().split()[0]  # Remove ASC/DESC
-                if '.' in item:
-                    table, col = item.split('.', 1)
-                    columns.add((table.strip(), col.strip()))
-                else:
-                    # Infer table from FROM clause
-                    from_match = re.search(r'FROM\s+(\w+)', query, re.IGNORECASE)
-                    if from_match:
-                        columns.add((from_match.group(1), item.strip()))
-        
-        return columns
+    @staticmethod
+    def _column_ref(token, main_table):
+        """(table, column) for an identifier; unqualified names go to main_table"""
+        if not isinstance(token, Identifier):
+            return None
+        column = token.get_real_name()
+        table = token.get_parent_name() or main_table
+        if not column or not table:
+            return None
+        return (table, column)
     
     def _get_existing_indexes(self) -> Dict:
-        """Get all existing indexes from database"""
+        """Get all existing indexes from database (cached for INDEX_CACHE_TTL seconds)"""
+        if self._idx_cache is not None and time.time() - self._idx_cache_ts < INDEX_CACHE_TTL:
+            return self._idx_cache
+        
         indexes = {}
+        self._indexed_columns = {}
         
         try:
-            with self.connection.cursor() as cur:
-                cur.execute("""
-                    SELECT 
-                        schemaname, tablename, indexname, indexdef
-                    FROM pg_indexes 
-                    WHERE schemaname = 'public'
-                """)
+            with borrow_conn() as conn, conn.cursor() as cur:
+                self._prepare_index_query(conn, cur)
+                cur.execute(f"EXECUTE {_INDEX_STMT}")
                 
                 for row in cur.fetchall():
                     schema, table, idx_name, idx_def = row
                     if table not in indexes:
                         indexes[table] = []
+                    columns = self._parse_index_columns(idx_def)
                     indexes[table].append({
                         'name': idx_name,
-                        'definition': idx_def
+                        'definition': idx_def,
+                        'columns': frozenset(columns)
                     })
+                    if columns:
+                        self._indexed_columns.setdefault(table, set()).add(columns[0])
         except Exception as e:
             print(f"Error fetching indexes: {e}")
+            # Re-check the prepared statement next time rather than trust it
+            IndexRecommender._prepared_on.clear()
+            return indexes
         
+        self._idx_cache = indexes
+        self._idx_cache_ts = time.time()
         return indexes
     
-    def _has_index(self, existing_indexes: Dict, table: str, column: str) -> bool:
-        """Check if an index exists on the specified column"""
-        if table not in existing_indexes:
-            return False
-        
-        for idx in existing_indexes[table]:
-            if f"({column})" in idx['definition'] or f"({column}," in idx['definition']:
-                return True
-        
-        return False
+    @staticmethod
+    def _prepare_index_query(conn, cur):
+        """PREPARE the pg_indexes lookup once per pooled connection"""
+        if conn in IndexRecommender._prepared_on:
+            return
+        cur.execute("SELECT 1 FROM pg_prepared_statements WHERE name = %s", (_INDEX_STMT,))
+        if cur.fetchone() is None:
+            cur.execute(f"PREPARE {_INDEX_STMT} AS {_INDEX_SQL}")
+        IndexRecommender._prepared_on.add(conn)
     
-    def _get_index_reason(self, table: str, column: str, query: str) -> str:
+    @staticmethod
+    def _parse_index_columns(idx_def: str) -> List[str]:
+        """Column names, in index order, from a pg_indexes indexdef"""
+        match = _INDEX_COLUMNS_RE.search(idx_def)
+        if not match:
+            return []
+        return [part.split()[0].strip('"') for part in match.group(1).split(',') if part.strip()]
+    
+    def _has_index(self, table: str, column: str) -> bool:
+        """Check if an index on the table leads with the specified column"""
+        return column in self._indexed_columns.get(table, _EMPTY)
+    
+    def _get_index_reason(self, column: str, q_lower: str, clauses: Tuple[bool, bool, bool]) -> str:
         """Determine why this index is recommended"""
-        q_lower = query.lower()
+        has_where, has_join, has_order = clauses
+        referenced = column.lower() in q_lower
         
-        if f"where" in q_lower and column.lower() in q_lower:
+        if has_where and referenced:
             return f"Used in WHERE clause filter"
-        elif f"join" in q_lower and column.lower() in q_lower:
+        elif has_join and referenced:
             return f"Used in JOIN condition"
-        elif f"order by" in q_lower and column.lower() in q_lower:
+        elif has_order and referenced:
             return f"Used in ORDER BY clause"
         else:
             return f"Referenced in query conditions"
     
-    def _calculate_priority(self, table: str, column: str, query: str) -> int:
+    def _calculate_priority(self, column: str, q_lower: str, clauses: Tuple[bool, bool, bool]) -> int:
         """Calculate index priority (1-10, 10 being highest)"""
         priority = 5  # Base priority
-        q_lower = query.lower()
-        
-        # Higher priority for WHERE clause columns
-        if "where" in q_lower and column.lower() in q_lower:
-            priority += 3
+        if column.lower() not in q_lower:
+            return priority
+        has_where, has_join, has_order = clauses
         
-        # Medium priority for JOIN columns
-        if "join" in q_lower and column.lower() in q_lower:
-            priority += 2
-        
-        # Lower priority for ORDER BY only
-        if "order by" in q_lower and column.lower() in q_lower:
-            priority += 1
+        # +3 for WHERE clause columns, +2 for JOIN columns, +1 for ORDER BY
+        priority += 3 * has_where + 2 * has_join + has_order
         
         return min(priority, 10)
     
@@ -215,59 +295,38 @@ class IndexRecommender:
         
         return composite_candidates
     
-    def _calculate_complexity(self, query: str) -> int:
-        """Calculate query complexity score"""
-        score = 0
-        q_lower = query.lower()
-        
-        # Count different elements
-        score += q_lower.count("join") * 2
-        score += q_lower.count("where") * 1
-        score += q_lower.count("order by") * 1
-        score += q_lower.count("group by") * 1
-        score += q_lower.count("having") * 2
-        score += q_lower.count("union") * 3
-        score += q_lower.count("exists") * 2
-        score += q_lower.count("in (") * 1
-        
-        return score
+    def _calculate_complexity(self, kw: Counter) -> int:
+        """Calculate query complexity score from the query's keyword counts"""
+        return (2 * kw['join'] + kw['where'] + kw['order by'] + kw['group by']
+                + 2 * kw['having'] + 3 * (kw['union'] + kw['union all'])
+                + 2 * kw['exists'] + kw['in'])
     
     def generate_report(self, query: str) -> str:
         """Generate formatted index recommendation report"""
-        recommendations = self.analyze_query(query)
-        
-        report = []
-        report.append("📊 INDEX ANALYSIS REPORT")
-        report.append("=" * 50)
+        return "\n".join(self._emit_lines(self.analyze_query(query)))
+    
+    @staticmethod
+    def _emit_lines(recommendations: Dict):
+        """Yield the report lines for one analyze_query result"""
+        yield "📊 INDEX ANALYSIS REPORT"
+        yield "=" * 50
         
         # Query complexity
-        analysis = recommendations['query_analysis']
-        report.append(f"\n🔍 Query Complexity Score: {analysis['complexity_score']}")
-        report.append(f"   • WHERE columns: {analysis['where_columns']}")
-        report.append(f"   • JOIN columns: {analysis['join_columns']}")  
-        report.append(f"   • ORDER BY columns: {analysis['order_columns']}")
+        yield _TMPL_ANALYSIS.format_map(recommendations['query_analysis'])
         
         # Missing indexes
         missing = recommendations['missing_indexes']
         if missing:
-            report.append(f"\n⚠️ RECOMMENDED INDEXES ({len(missing)} suggestions):")
+            yield f"\n⚠️ RECOMMENDED INDEXES ({len(missing)} suggestions):"
             for idx in sorted(missing, key=lambda x: x['priority'], reverse=True):
-                priority_emoji = "🔴" if idx['priority'] >= 8 else "🟡" if idx['priority'] >= 6 else "🟢"
-                report.append(f"   {priority_emoji} Priority {idx['priority']}: {idx['table']}.{idx['column']}")
-                report.append(f"      Reason: {idx['reason']}")
-                report.append(f"      SQL: {idx['sql']}")
-                report.append("")
+                yield _TMPL_IDX.format_map(idx | {'emoji': _PRIO_EMOJI[idx['priority']]})
         
         # Composite indexes
         composite = recommendations['composite_indexes']
         if composite:
-            report.append(f"\n🔗 COMPOSITE INDEX OPPORTUNITIES:")
+            yield f"\n🔗 COMPOSITE INDEX OPPORTUNITIES:"
             for idx in composite:
-                report.append(f"   • {idx['table']}: {', '.join(idx['columns'])}")
-                report.append(f"     SQL: {idx['sql']}")
-                report.append("")
+                yield _TMPL_COMPOSITE.format_map(idx | {'column_list': ', '.join(idx['columns'])})
         
         if not missing and not composite:
-            report.append("\n✅ No immediate index recommendations - query looks well-optimized!")
-        
-        return "\n".join(report)
\ No newline at end of file
+            yield "\n✅ No immediate index recommendations - query looks well-optimized!"
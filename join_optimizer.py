@@ -1,42 +1,68 @@
 # join_optimizer.py
 import re
-from db import get_connection
+import time
+from functools import lru_cache
+from types import MappingProxyType
+from db import borrow_conn
 from typing import List, Tuple, Dict
 
-def _get_alias_map(query: str) -> Dict[str,str]:
+_FROM_RE = re.compile(r"FROM\s+(\w+)(?:\s+(\w+))?", re.IGNORECASE)
+_JOIN_RE = re.compile(r"JOIN\s+(\w+)(?:\s+(\w+))?", re.IGNORECASE)
+# JOIN <table> <alias?> ON <condition> (stops before next JOIN/WHERE/; )
+_JOIN_ON_RE = re.compile(r"JOIN\s+(\w+)(?:\s+(\w+))?\s+ON\s+([^;]+?)(?=(?:\s+JOIN|\s+WHERE|;|$))",
+                         re.IGNORECASE | re.DOTALL)
+_WHERE_RE = re.compile(r"WHERE\s+(.+)", re.IGNORECASE | re.DOTALL)
+_WHERE_KEYWORD_RE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+# x.col = y.col inside an ON clause -> (x, y)
+_EQUI_JOIN_RE = re.compile(r"(\w+)\.\w+\s*=\s*(\w+)\.\w+")
+
+# Join orders are enumerated exhaustively up to this many tables
+DP_MAX_RELATIONS = 12
+
+# (dsn, table) -> (fetched_at, reltuples or None); planner stats move slowly
+_RELTUPLES_CACHE: Dict[Tuple[str, str], Tuple[float, int]] = {}
+_CACHE_TTL = 60.0
+
+def reset_stats_cache():
+    """Forget cached pg_class row estimates."""
+    _RELTUPLES_CACHE.clear()
+
+@lru_cache(maxsize=512)
+def _get_alias_map(query: str) -> Tuple[Dict[str,str], Dict[str,str]]:
     """
     Return mapping alias -> table and table -> alias for FROM and JOINs.
+    Cached per query; both mappings are read-only.
     """
     alias_map = {}
     table_map = {}
 
     # FROM table
-    m = re.search(r"FROM\s+(\w+)(?:\s+(\w+))?", query, re.IGNORECASE)
+    m = _FROM_RE.search(query)
     if m:
         table, alias = m.group(1).lower(), (m.group(2) or m.group(1)).lower()
         alias_map[alias] = table
         table_map[table] = alias
 
     # JOINs
-    for jt, ja in re.findall(r"JOIN\s+(\w+)(?:\s+(\w+))?", query, re.IGNORECASE):
+    for jt, ja in _JOIN_RE.findall(query):
         table = jt.lower()
         alias = (ja or jt).lower()
         alias_map[alias] = table
         table_map[table] = alias
 
-    return alias_map, table_map
+    return MappingProxyType(alias_map), MappingProxyType(table_map)
 
+@lru_cache(maxsize=512)
 def _get_join_conditions(query: str):
     """
-    Returns a mapping table_alias -> ON condition string (original).
+    Returns a read-only mapping table_alias -> ON condition string (original).
+    Cached per query.
     """
     join_conds = {}
-    # Pattern matches: JOIN <table> <alias?> ON <condition> (stops before next JOIN/WHERE/; )
-    for jt, ja, cond in re.findall(r"JOIN\s+(\w+)(?:\s+(\w+))?\s+ON\s+([^;]+?)(?=(?:\s+JOIN|\s+WHERE|;|$))",
-                                   query, re.IGNORECASE | re.DOTALL):
+    for jt, ja, cond in _JOIN_ON_RE.findall(query):
         alias = (ja or jt).lower()
         join_conds[alias] = cond.strip()
-    return join_conds
+    return MappingProxyType(join_conds)
 
 def estimate_table_rows(conn, table_name: str) -> int:
     """
@@ -51,94 +77,191 @@ def estimate_table_rows(conn, table_name: str) -> int:
         """, (table_name,))
         row = cur.fetchone()
         cur.close()
-        if row and row[0] is not None:
+        # reltuples is -1 (or 0) for never-analyzed tables: treat as unknown
+        if row and row[0] is not None and row[0] > 0:
             return int(row[0])
     except Exception:
         pass
     # fallback
     return 1000
 
-def optimize_join_order(query: str, max_steps: int = 100) -> List[str]:
+def estimate_tables_rows(conn, table_names) -> Dict[str, int]:
     """
-    Greedy heuristic to produce a good join order (list of table aliases).
-    Returns list of table aliases in chosen order (alias strings).
+    Batched estimate_table_rows: one pg_class round-trip for all tables.
+    Returns table -> reltuples for the tables pg_class knows about.
+    Results are cached per database for _CACHE_TTL seconds.
     """
-    conn = None
+    dsn = getattr(conn, "dsn", "")
+    now = time.monotonic()
+    sizes, missing = {}, []
+    for table in table_names:
+        hit = _RELTUPLES_CACHE.get((dsn, table))
+        if hit and now - hit[0] < _CACHE_TTL:
+            if hit[1] is not None:
+                sizes[table] = hit[1]
+        else:
+            missing.append(table)
+    if not missing:
+        return sizes
+
     try:
-        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT relname, reltuples::bigint
+            FROM pg_class
+            WHERE relname = ANY(%s)
+        """, (missing,))
+        rows = cur.fetchall()
+        cur.close()
     except Exception:
-        conn = None  # will use simple heuristic if no DB
+        return sizes
 
-    alias_map, table_map = _get_alias_map(query)
-    if not alias_map:
-        return []
+    # reltuples is -1 (or 0) for never-analyzed tables: leave those unknown
+    fetched = {name: int(est) for name, est in rows if est is not None and est > 0}
+    for table in missing:
+        _RELTUPLES_CACHE[(dsn, table)] = (now, fetched.get(table))
+    sizes.update(fetched)
+    return sizes
 
-    # get join conditions and adjacency
-    join_conds = _get_join_conditions(query)
+def _join_graph(aliases: List[str], alias_map, join_conds) -> Dict[str, set]:
+    """
+    Adjacency alias -> aliases it shares an `x.col = y.col` predicate with.
+    ON clauses may name either the alias or the bare table.
+    """
+    lookup = {a: a for a in aliases}
+    for a in aliases:
+        lookup.setdefault(alias_map[a], a)
+    graph = {a: set() for a in aliases}
+    for cond in join_conds.values():
+        for left, right in _EQUI_JOIN_RE.findall(cond):
+            a, b = lookup.get(left.lower()), lookup.get(right.lower())
+            if a and b and a != b:
+                graph[a].add(b)
+                graph[b].add(a)
+    return graph
 
-    # candidates = list of aliases
-    aliases = list(alias_map.keys())
+def _dp_join_order(aliases: List[str], size_by_alias, graph) -> List[str]:
+    """
+    Selinger-style bottom-up DP over left-deep orders without cross products.
+    Cost of a plan is the sum of its intermediate result sizes; each join edge
+    is given the uniform equi-join selectivity 1 / max(|a|, |b|).
+    Returns [] when the join graph is not connected.
+    """
+    def cardinality(subset, prev_card, added):
+        card = prev_card * size_by_alias[added]
+        for other in graph[added] & subset:
+            card /= max(size_by_alias[added], size_by_alias[other], 1)
+        return card
 
-    # estimate sizes
-    size_by_alias = {}
-    for a in aliases:
-        table = alias_map[a]
-        est = None
-        if conn:
-            try:
-                est = estimate_table_rows(conn, table)
-            except Exception:
-                est = None
-        size_by_alias[a] = est or 1000
-
-    # Try to find seed: alias used by WHERE (most selective)
-    where_match = re.search(r"WHERE\s+(.+)", query, re.IGNORECASE | re.DOTALL)
-    preferred_alias = None
-    if where_match:
-        where_block = where_match.group(1)
-        # pick alias referenced most in where_block
-        counts = {a: where_block.lower().count(f"{a}.") for a in aliases}
-        preferred_alias = max(counts, key=lambda k: counts[k]) if any(counts.values()) else None
-
-    # seed choice: prefer preferred_alias if exists, else smallest table
-    if preferred_alias and counts[preferred_alias] > 0:
-        order = [preferred_alias]
+    # subset -> (cost, cardinality, order)
+    level = {frozenset([a]): (0.0, float(size_by_alias[a]), [a]) for a in aliases}
+    for _ in range(len(aliases) - 1):
+        next_level = {}
+        for subset, (cost, card, order) in level.items():
+            neighbours = set().union(*(graph[a] for a in subset)) - subset
+            for a in neighbours:
+                joined = subset | {a}
+                new_card = cardinality(subset, card, a)
+                new_cost = cost + new_card
+                if joined not in next_level or new_cost < next_level[joined][0]:
+                    next_level[joined] = (new_cost, new_card, order + [a])
+        if not next_level:
+            return []
+        level = next_level
+
+    plan = level.get(frozenset(aliases))
+    return plan[2] if plan else []
+
+def _greedy_join_order(query: str, aliases: List[str], alias_map, join_conds,
+                       size_by_alias, graph, max_steps: int = 100) -> List[str]:
+    """
+    Greedy heuristic: seed from the join edge with the smallest estimated
+    result, then repeatedly add the smallest table joined to the current set.
+    Tables with no join to the current set (cross products) go last.
+    """
+    # WHERE references break ties between equally small seeds
+    where_match = _WHERE_RE.search(query)
+    where_block = where_match.group(1).lower() if where_match else ""
+    where_refs = {a: where_block.count(f"{a}.") for a in aliases}
+
+    # seed choice: smallest non-cross-product join, |a JOIN b| ~ min(|a|, |b|)
+    edges = [(a, b) for a in aliases for b in graph[a] if a < b]
+    if edges:
+        a, b = min(edges, key=lambda e: (min(size_by_alias[e[0]], size_by_alias[e[1]]),
+                                         -(where_refs[e[0]] + where_refs[e[1]])))
+        order = sorted((a, b), key=lambda x: size_by_alias[x])
     else:
-        order = [min(aliases, key=lambda a: size_by_alias.get(a, 1e9))]
+        order = [min(aliases, key=lambda a: (size_by_alias.get(a, 1e9), -where_refs[a]))]
 
     remaining = [a for a in aliases if a not in order]
 
+    # Bitmask of the aliases each table is joined to: equi-join edges from either
+    # side's ON clause, plus any alias r's own ON clause references
+    alias_bit = {a: 1 << i for i, a in enumerate(aliases)}
+    cond_mask = {}
+    for r in aliases:
+        cond = join_conds.get(r, "")
+        mask = 0
+        for a in aliases:
+            if a in graph[r] or f"{a}." in cond or f"{alias_map[a]}." in cond:
+                mask |= alias_bit[a]
+        cond_mask[r] = mask
+    order_mask = 0
+    for a in order:
+        order_mask |= alias_bit[a]
+
     # Greedily add a next table that has a join condition with current set and minimal size
     steps = 0
     while remaining and steps < max_steps:
         steps += 1
-        candidates = []
-        for r in remaining:
-            # check if r has ON condition referencing any alias in order by looking for order alias in its ON clause or vice versa
-            cond = join_conds.get(r, "")
-            connected = any((f"{a}." in cond or f"{alias_map[a]}." in cond) for a in order)
-            if connected:
-                candidates.append((r, size_by_alias.get(r, 1000)))
+        candidates = [(r, size_by_alias.get(r, 1000)) for r in remaining if cond_mask[r] & order_mask]
         if not candidates:
-            # if none connected, pick smallest remaining
-            next_alias = min(remaining, key=lambda a: size_by_alias.get(a, 1000))
-        else:
-            # pick smallest candidate
-            next_alias = min(candidates, key=lambda x: x[1])[0]
+            # only cross products left; they go to the tail below
+            break
+        # pick smallest candidate
+        next_alias = min(candidates, key=lambda x: x[1])[0]
         order.append(next_alias)
+        order_mask |= alias_bit[next_alias]
         remaining.remove(next_alias)
 
-    # if remaining still left (rare), append them
-    order.extend([a for a in remaining if a not in order])
-
-    if conn:
-        try:
-            conn.close()
-        except:
-            pass
+    # cross products (and anything past max_steps) last, smallest first
+    order.extend(sorted(remaining, key=lambda a: size_by_alias.get(a, 1000)))
 
     return order
 
+def optimize_join_order(query: str, max_steps: int = 100) -> List[str]:
+    """
+    Choose a join order (list of table aliases) for the query.
+    Uses exhaustive DP for up to DP_MAX_RELATIONS tables whose join graph is
+    connected, and the greedy heuristic otherwise.
+    Returns list of table aliases in chosen order (alias strings).
+    """
+    alias_map, table_map = _get_alias_map(query)
+    if not alias_map:
+        return []
+
+    # get join conditions and adjacency
+    join_conds = _get_join_conditions(query)
+
+    # candidates = list of aliases
+    aliases = list(alias_map.keys())
+
+    # estimate sizes (one pg_class lookup for every table in the query)
+    try:
+        with borrow_conn() as conn:
+            size_by_table = estimate_tables_rows(conn, set(alias_map.values()))
+    except Exception:
+        size_by_table = {}  # will use simple heuristic if no DB
+    size_by_alias = {a: size_by_table.get(alias_map[a]) or 1000 for a in aliases}
+
+    graph = _join_graph(aliases, alias_map, join_conds)
+    if len(aliases) <= DP_MAX_RELATIONS:
+        order = _dp_join_order(aliases, size_by_alias, graph)
+        if order:
+            return order
+
+    return _greedy_join_order(query, aliases, alias_map, join_conds, size_by_alias, graph, max_steps)
+
 def reorder_query_by_alias_order(query: str, alias_order: List[str]) -> str:
     """
     Rebuild FROM + JOIN clauses according to alias_order (uses original ON conditions).
@@ -164,10 +287,12 @@ def reorder_query_by_alias_order(query: str, alias_order: List[str]) -> str:
             return query
         join_parts.append(f"JOIN {table} {alias} ON {on}")
 
-    # replace the original FROM...JOIN block with new block
-    # naive approach: replace from first FROM up to WHERE or end
-    prefix = re.split(r"\bWHERE\b", query, flags=re.IGNORECASE)[0]
-    rest = query[len(prefix):]  # remainder (WHERE ... or '')
+    # replace the original FROM...JOIN block (first FROM up to WHERE or end) with new block
+    from_match = _FROM_RE.search(query)
+    if not from_match:
+        return query
+    from_start = from_match.start()
+    where_match = _WHERE_KEYWORD_RE.search(query, from_start)
+    from_end = where_match.start() if where_match else len(query)
     new_from_block = from_clause + "\n" + "\n".join(join_parts) + "\n"
-    new_query = re.sub(r"FROM\s+(.+?)(?=(\bWHERE\b|$))", new_from_block, query, flags=re.IGNORECASE | re.DOTALL)
-    return new_query
+    return query[:from_start] + new_from_block + query[from_end:]
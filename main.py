@@ -34,6 +34,8 @@ except:
 def main():
     parser = argparse.ArgumentParser(description="SQL Query Optimizer CLI")
     parser.add_argument("--query", type=str, required=True, help="SQL query to optimize")
+    parser.add_argument("--skip-original-explain", action="store_true",
+                        help="Don't EXPLAIN the original query for the log entry")
     args = parser.parse_args()
 
     original_query = args.query
@@ -59,9 +61,11 @@ def main():
     # Use our improved cost comparator
     comparator = CostComparator()
     candidate_queries = [c for c in candidates if c != original_query]  # Remove duplicates
+    cost_by_query = {}  # best_estimate per query, so later steps don't re-estimate
     
     if candidate_queries:
         results = comparator.compare_queries(original_query, candidate_queries[:5])  # Limit for performance
+        cost_by_query = {query: costs['best_estimate'] for _, query, costs in results}
         
         # Extract best result
         best_name, best_query, best_costs = results[0]
@@ -89,7 +93,7 @@ def main():
     else:
         print("   No alternative candidates generated")
         best_query = original_query
-        best_cost = comparator.get_best_cost_estimate(original_query)
+        best_cost = cost_by_query[original_query] = comparator.get_best_cost_estimate(original_query)
 
     print("\n--- BEST OPTIMIZED QUERY ---")
     print(best_query)
@@ -136,11 +140,11 @@ def main():
     original_features = extract_features(original_query)
     best_features = extract_features(best_query)
     
-    print(f"Original query complexity: {original_features['query_complexity']:.1f}")
-    print(f"Optimized query complexity: {best_features['query_complexity']:.1f}")
-    print(f"Tables involved: {original_features['num_tables']}")
-    print(f"JOIN operations: {original_features['num_joins']}")
-    print(f"WHERE conditions: {original_features['num_conditions']}")
+    print(f"Original query complexity: {original_features.query_complexity:.1f}")
+    print(f"Optimized query complexity: {best_features.query_complexity:.1f}")
+    print(f"Tables involved: {original_features.num_tables}")
+    print(f"JOIN operations: {original_features.num_joins}")
+    print(f"WHERE conditions: {original_features.num_conditions}")
 
     # 5️⃣ EXPLAIN summary
     print("\n--- EXECUTION PLAN (BEST QUERY) ---")
@@ -156,16 +160,21 @@ def main():
         print("EXPLAIN failed.")
 
     # 6️⃣ Log the query results
-    explain_orig = run_explain(original_query)
-    original_cost = comparator.get_best_cost_estimate(original_query)
-    
-    # Extract features for logging
-    original_features = extract_features(original_query)
+    if args.skip_original_explain:
+        explain_orig = None
+    elif best_query == original_query:
+        explain_orig = explain_json  # same query, same plan
+    else:
+        explain_orig = run_explain(original_query)
+    original_cost = cost_by_query.get(original_query)
+    if original_cost is None:
+        original_cost = comparator.get_best_cost_estimate(original_query)
     
+    # original_features from the summary above is what gets logged
     log_query(
         original_query, best_query,
         original_cost, best_cost, candidate_runtime,
-        features=original_features,  # Pass features dict
+        features=original_features.as_dict(),  # Pass features dict
         explain_original=explain_orig, 
         explain_rewritten=explain_json
     )
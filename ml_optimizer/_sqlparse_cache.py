@@ -0,0 +1,14 @@
+# ml_optimizer/_sqlparse_cache.py
+import sqlparse
+from functools import lru_cache
+
+
+@lru_cache(maxsize=1024)
+def parse_cached(query: str):
+    """
+    First statement of sqlparse.parse(query), or None for an empty query.
+    Shared across the rule engine, feature extraction and candidate generation,
+    so the tree must be treated as read-only.
+    """
+    parsed = sqlparse.parse(query)
+    return parsed[0] if parsed else None
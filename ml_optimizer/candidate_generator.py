@@ -1,26 +1,29 @@
-import sqlparse
 import itertools
+import math
 import random
+from functools import lru_cache
+from types import MappingProxyType
+from ml_optimizer._sqlparse_cache import parse_cached
 
 
 # -----------------------------------------
 # Helper: Extract tables, joins, and where
 # -----------------------------------------
+@lru_cache(maxsize=512)
 def extract_structure(query: str):
     """
     Parse SQL query using sqlparse and extract FROM, JOIN, and WHERE components.
-    Returns:
+    Cached per query, so the result is a read-only mapping:
         {
             "from": str,
-            "joins": list[str],
+            "joins": tuple[str, ...],
             "where": str
         }
     """
-    parsed = sqlparse.parse(query)
-    if not parsed:
-        return {"from": None, "joins": [], "where": None}
+    stmt = parse_cached(query)
+    if stmt is None:
+        return MappingProxyType({"from": None, "joins": (), "where": None})
 
-    stmt = parsed[0]
     tokens = [t for t in stmt.tokens if not t.is_whitespace]
 
     from_clause, joins, where_clause = None, [], None
@@ -37,86 +40,95 @@ def extract_structure(query: str):
             where_clause = tok.value
             mode = "WHERE"
 
-    return {"from": from_clause, "joins": joins, "where": where_clause}
+    return MappingProxyType({"from": from_clause, "joins": tuple(joins), "where": where_clause})
 
 
 # -----------------------------------------
 # Candidate Generation Strategies
+# (generators, so generate_candidates can stop early)
 # -----------------------------------------
 def original_query(query: str):
-    return [("original", query)]
+    yield ("original", query)
 
 
-def join_permutations(query: str, limit: int = 20, deterministic: bool = False):
+def join_permutations(query: str, limit: int = 20, deterministic: bool = False, struct=None):
     """
     Generate join order permutations.
     - If join count <= 4 → try all permutations.
-    - If join count > 4 → sample up to `limit` permutations.
+    - If join count > 4 → sample up to `limit` distinct permutations.
+    Pass `struct` to reuse an extract_structure() result.
     """
-    struct = extract_structure(query)
+    if struct is None:
+        struct = extract_structure(query)
     joins = struct["joins"]
 
     if not joins:
-        return []
+        return
 
-    candidates = []
     n = len(joins)
     if n <= 4:
         # all permutations (small factorials)
         perms = itertools.permutations(joins)
     else:
-        # sample permutations
-        joins_list = list(joins)
-        if deterministic:
-            random.seed(42)
-        perms = (random.sample(joins_list, n) for _ in range(limit))
+        perms = _distinct_samples(joins, limit, deterministic)
 
+    # placeholder SELECT; only the join list changes between candidates
+    prefix = "SELECT * " + (struct["from"] + " " if struct["from"] else "")
+    suffix = " " + struct["where"] if struct["where"] else ""
     for perm in itertools.islice(perms, limit):
-        q = "SELECT * "  # placeholder SELECT
-        if struct["from"]:
-            q += struct["from"] + " "
-        q += " ".join(perm)
-        if struct["where"]:
-            q += " " + struct["where"]
-        candidates.append(("join_perm", q.strip()))
+        yield ("join_perm", "".join((prefix, " ".join(perm), suffix)).strip())
 
-    return candidates
 
+def _distinct_samples(joins, limit: int, deterministic: bool):
+    """Random permutations of `joins`, never repeating, at most min(limit, n!)."""
+    n = len(joins)
+    rng = random.Random(42 if deterministic else None)
+    target = min(limit, math.factorial(n))
+    seen = set()
+    while len(seen) < target:
+        perm = tuple(rng.sample(joins, n))
+        if perm in seen:
+            continue
+        seen.add(perm)
+        yield perm
 
-def reverse_joins(query: str):
-    struct = extract_structure(query)
+
+def reverse_joins(query: str, struct=None):
+    if struct is None:
+        struct = extract_structure(query)
     joins = struct["joins"]
 
     if not joins:
-        return []
+        return
 
-    q = "SELECT * "
-    if struct["from"]:
-        q += struct["from"] + " "
-    q += " ".join(reversed(joins))
-    if struct["where"]:
-        q += " " + struct["where"]
-    return [("reverse_joins", q.strip())]
+    q = "".join((
+        "SELECT * ",
+        struct["from"] + " " if struct["from"] else "",
+        " ".join(reversed(joins)),
+        " " + struct["where"] if struct["where"] else "",
+    ))
+    yield ("reverse_joins", q.strip())
 
 
-def predicate_pushdown(query: str):
-    struct = extract_structure(query)
+def predicate_pushdown(query: str, struct=None):
+    if struct is None:
+        struct = extract_structure(query)
     if not struct["where"]:
-        return []
+        return
 
     q = query.replace("FROM", "FROM (SELECT * FROM", 1)
     q = q.replace(struct["where"], f"){struct['where']}", 1)
-    return [("predicate_pushdown", q.strip())]
+    yield ("predicate_pushdown", q.strip())
 
 
 def exists_rewrite(query: str):
     if "JOIN" not in query.upper():
-        return []
+        return
 
     q = query.replace("JOIN", "WHERE EXISTS (SELECT 1 FROM")
     if not q.strip().endswith(")"):
         q += ")"
-    return [("exists_rewrite", q.strip())]
+    yield ("exists_rewrite", q.strip())
 
 
 # -----------------------------------------
@@ -125,6 +137,7 @@ def exists_rewrite(query: str):
 def generate_candidates(query: str, limit: int = 10, deterministic: bool = False):
     """
     Generate candidate rewrites for a query.
+    Strategies are consumed lazily and stop once `limit` unique candidates exist.
     Args:
         query (str) : SQL query
         limit (int) : Max number of candidates (approx, after sampling)
@@ -132,39 +145,34 @@ def generate_candidates(query: str, limit: int = 10, deterministic: bool = False
     Returns:
         list of (strategy_name, candidate_sql)
     """
-    candidates = []
-
-    # Always include original
-    candidates.extend(original_query(query))
-
-    # Join permutations
-    candidates.extend(join_permutations(query, limit=limit, deterministic=deterministic))
-
-    # Reverse joins
-    candidates.extend(reverse_joins(query))
-
-    # Predicate pushdown
-    candidates.extend(predicate_pushdown(query))
+    struct = extract_structure(query)
 
-    # EXISTS rewrite
-    candidates.extend(exists_rewrite(query))
+    strategies = itertools.chain(
+        original_query(query),  # always first
+        join_permutations(query, limit=limit, deterministic=deterministic, struct=struct),
+        reverse_joins(query, struct=struct),
+        predicate_pushdown(query, struct=struct),
+        exists_rewrite(query),
+    )
 
-    # Deduplicate
+    # Deduplicate, stopping as soon as we have enough
     seen = set()
     unique = []
-    for strategy, cand in candidates:
-        if cand not in seen:
-            unique.append((strategy, cand))
-            seen.add(cand)
-
-    # Shuffle (unless deterministic)
+    for strategy, cand in strategies:
+        if cand in seen:
+            continue
+        seen.add(cand)
+        unique.append((strategy, cand))
+        if len(unique) >= limit:
+            break
+
+    # Shuffle the rewrites (unless deterministic); original stays first
     if not deterministic:
-        random.shuffle(unique)
-
-    # Always keep original as first
-    unique = sorted(unique, key=lambda x: 0 if x[0] == "original" else 1)
+        rewrites = unique[1:]
+        random.shuffle(rewrites)
+        unique[1:] = rewrites
 
-    return unique[:limit]
+    return unique
 
 
 # -----------------------------------------
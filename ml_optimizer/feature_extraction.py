@@ -1,6 +1,17 @@
 import re
-import sqlparse
-from typing import Dict, Any
+from dataclasses import dataclass, fields
+import numpy as np
+from functools import lru_cache
+from typing import Dict, Any, List, Sequence
+from sqlparse import tokens as T
+from ml_optimizer._sqlparse_cache import parse_cached
+
+AGG_FUNCTIONS = ('COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'GROUP_CONCAT')
+
+# Keyword flags are plain substring checks on padded_lower(); only these need a regex
+_IN_RE = re.compile(r'\bIN\s*\(', re.IGNORECASE)
+_COMPARISON_RE = re.compile(r'[<>=!]+')
+_PAD_TABLE = str.maketrans({c: f' {c} ' for c in '(),;'})
 
 def count_joins(query: str) -> int:
     """Count JOIN occurrences in the SQL query."""
@@ -13,9 +24,8 @@ def count_subqueries(query: str) -> int:
 
 def count_aggregations(query: str) -> int:
     """Count aggregation functions."""
-    agg_functions = ['COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'GROUP_CONCAT']
     count = 0
-    for func in agg_functions:
+    for func in AGG_FUNCTIONS:
         # Fixed: Use proper string concatenation instead of f-string with raw string
         pattern = r'\b' + func + r'\s*\('
         count += len(re.findall(pattern, query, re.IGNORECASE))
@@ -49,37 +59,44 @@ def extract_table_count(query: str) -> int:
     
     return len(tables)
 
-def extract_selectivity_features(query: str) -> Dict[str, int]:
-    """Extract query selectivity indicators."""
+def padded_lower(query: str) -> str:
+    """Lowercased query with whitespace collapsed and ( ) , ; spaced out, padded by one space."""
+    return f" {' '.join(query.lower().translate(_PAD_TABLE).split())} "
+
+def extract_selectivity_features(query: str, q_padded: str = None) -> Dict[str, int]:
+    """
+    Extract query selectivity indicators.
+    Pass `q_padded` to reuse an existing padded_lower(query).
+    """
+    q = q_padded if q_padded is not None else padded_lower(query)
     features = {}
     
     # Range queries
-    features['has_between'] = 1 if re.search(r'\bBETWEEN\b', query, re.IGNORECASE) else 0
-    features['has_like'] = 1 if re.search(r'\bLIKE\b', query, re.IGNORECASE) else 0
-    features['has_in'] = 1 if re.search(r'\bIN\s*\(', query, re.IGNORECASE) else 0
+    features['has_between'] = 1 if ' between ' in q else 0
+    features['has_like'] = 1 if ' like ' in q else 0
+    features['has_in'] = 1 if _IN_RE.search(query) else 0
     
     # Comparison operators
-    features['comparison_ops'] = len(re.findall(r'[<>=!]+', query))
+    features['comparison_ops'] = len(_COMPARISON_RE.findall(query))
     
     # DISTINCT
-    features['has_distinct'] = 1 if re.search(r'\bDISTINCT\b', query, re.IGNORECASE) else 0
+    features['has_distinct'] = 1 if ' distinct ' in q else 0
     
     # ORDER BY and GROUP BY
-    features['has_order_by'] = 1 if re.search(r'\bORDER\s+BY\b', query, re.IGNORECASE) else 0
-    features['has_group_by'] = 1 if re.search(r'\bGROUP\s+BY\b', query, re.IGNORECASE) else 0
+    features['has_order_by'] = 1 if ' order by ' in q else 0
+    features['has_group_by'] = 1 if ' group by ' in q else 0
     
     # LIMIT
-    features['has_limit'] = 1 if re.search(r'\bLIMIT\b', query, re.IGNORECASE) else 0
+    features['has_limit'] = 1 if ' limit ' in q else 0
     
     return features
 
 def estimate_query_complexity(query: str) -> float:
     """Estimate overall query complexity score."""
-    num_joins = count_joins(query)
-    num_subqueries = count_subqueries(query)
-    num_conditions = count_conditions(query)
-    num_aggregations = count_aggregations(query)
-    
+    return _complexity(count_joins(query), count_subqueries(query),
+                       count_conditions(query), count_aggregations(query))
+
+def _complexity(num_joins: int, num_subqueries: int, num_conditions: int, num_aggregations: int) -> float:
     # Weighted complexity score
     complexity = (
         num_joins * 2.0 +           # JOINs are expensive
@@ -90,58 +107,196 @@ def estimate_query_complexity(query: str) -> float:
     
     return complexity
 
-def extract_features(query: str, explain_json=None) -> Dict[str, Any]:
+def _scan_tokens(query: str) -> Dict[str, int]:
     """
-    Extract comprehensive features for ML model.
-    Returns consistent feature set for training and prediction.
+    Structural features from a single pass over the flattened sqlparse tokens.
+    Same counts as the regex helpers above, but keywords inside string
+    literals and comments are no longer counted.
     """
-    features = {}
-    
+    num_tokens = num_keywords = num_joins = num_selects = 0
+    num_aggregations = num_and_or = 0
+    tables = set()
+    has_where = in_where = expect_table = False
+    prev = None
+
+    for tok in parse_cached(query).flatten():
+        if tok.is_whitespace:
+            continue
+        num_tokens += 1
+        ttype = tok.ttype
+
+        # FROM/JOIN are followed directly by the table name
+        if expect_table:
+            expect_table = False
+            if ttype in T.Name:
+                tables.add(tok.value.lower())
+
+        if ttype in T.Keyword:
+            num_keywords += 1
+            word = tok.normalized
+            if word.endswith('JOIN'):
+                num_joins += 1
+                expect_table = True
+            elif word == 'FROM':
+                expect_table = True
+            elif word == 'SELECT':
+                num_selects += 1
+            elif word == 'WHERE':
+                has_where = in_where = True
+            elif word in ('AND', 'OR'):
+                num_and_or += in_where
+            elif word == 'LIMIT' or (word.startswith(('GROUP', 'ORDER')) and word.endswith('BY')):
+                in_where = False
+        elif ttype in T.Punctuation and tok.value == '(':
+            if prev is not None and prev.value.upper() in AGG_FUNCTIONS:
+                num_aggregations += 1
+        prev = tok
+
+    return {
+        'num_tables': len(tables),
+        'num_joins': num_joins,
+        'num_subqueries': max(0, num_selects - 1),
+        'num_conditions': num_and_or + 1 if has_where else 0,
+        'num_aggregations': num_aggregations,
+        'num_tokens': num_tokens,
+        'num_keywords': num_keywords,
+    }
+
+def _scan_regex(query: str) -> Dict[str, int]:
+    """Regex fallback for _scan_tokens when the query doesn't parse."""
+    return {
+        'num_tables': extract_table_count(query),
+        'num_joins': count_joins(query),
+        'num_subqueries': count_subqueries(query),
+        'num_conditions': count_conditions(query),
+        'num_aggregations': count_aggregations(query),
+        'num_tokens': 0,
+        'num_keywords': 0,
+    }
+
+@lru_cache(maxsize=4096)
+def _query_features(query: str) -> Dict[str, Any]:
+    """Query-text features (no EXPLAIN input), memoized on the raw query string."""
+    try:
+        scan = _scan_tokens(query)
+    except Exception:
+        scan = _scan_regex(query)
+
     # Basic structural features
-    features['num_tables'] = extract_table_count(query)
-    features['num_joins'] = count_joins(query)
-    features['num_subqueries'] = count_subqueries(query)
-    features['num_conditions'] = count_conditions(query)
-    features['num_aggregations'] = count_aggregations(query)
-    features['query_length'] = len(query)
-    features['query_complexity'] = estimate_query_complexity(query)
+    features = {
+        'num_tables': scan['num_tables'],
+        'num_joins': scan['num_joins'],
+        'num_subqueries': scan['num_subqueries'],
+        'num_conditions': scan['num_conditions'],
+        'num_aggregations': scan['num_aggregations'],
+        'query_length': len(query),
+        'query_complexity': _complexity(scan['num_joins'], scan['num_subqueries'],
+                                        scan['num_conditions'], scan['num_aggregations']),
+    }
     
     # Selectivity features
-    selectivity_features = extract_selectivity_features(query)
+    selectivity_features = extract_selectivity_features(query, padded_lower(query))
     features.update(selectivity_features)
     
     # Parse-based features
-    try:
-        parsed = sqlparse.parse(query)[0]
-        tokens = [t for t in parsed.flatten() if not t.is_whitespace]
-        features['num_tokens'] = len(tokens)
-        features['num_keywords'] = len([t for t in tokens if t.ttype in sqlparse.tokens.Keyword])
-    except:
-        features['num_tokens'] = 0
-        features['num_keywords'] = 0
+    features['num_tokens'] = scan['num_tokens']
+    features['num_keywords'] = scan['num_keywords']
+    
+    return features
+
+@dataclass(slots=True)
+class QueryFeatures:
+    """
+    Fixed feature set for one query, in model column order.
+    Also readable like the dict it replaced: feats['num_joins'], feats.get(...), feats.items().
+    """
+    # Query-text features
+    num_tables: int = 0
+    num_joins: int = 0
+    num_subqueries: int = 0
+    num_conditions: int = 0
+    num_aggregations: int = 0
+    query_length: int = 0
+    query_complexity: float = 0.0
+    has_between: int = 0
+    has_like: int = 0
+    has_in: int = 0
+    comparison_ops: int = 0
+    has_distinct: int = 0
+    has_order_by: int = 0
+    has_group_by: int = 0
+    has_limit: int = 0
+    num_tokens: int = 0
+    num_keywords: int = 0
+    # EXPLAIN-based features (0 when EXPLAIN is not available)
+    plan_rows: int = 0
+    plan_width: int = 0
+    startup_cost: float = 0.0
+    total_cost: float = 0.0
+    plan_type: int = 0
+    # Derived features
+    joins_per_table: float = 0.0
+    conditions_per_join: float = 0.0
+
+    def __getitem__(self, name: str):
+        if name not in _FEATURE_SET:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in _FEATURE_SET
+
+    def get(self, name: str, default=None):
+        return getattr(self, name) if name in _FEATURE_SET else default
+
+    def keys(self):
+        return FEATURE_NAMES
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in FEATURE_NAMES]
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Plain dict copy, e.g. for JSON logging."""
+        return {name: getattr(self, name) for name in FEATURE_NAMES}
+
+    def as_array(self, feature_order: Sequence[str] = None) -> np.ndarray:
+        """float32 row in `feature_order` (default: FEATURE_NAMES); unknown names are 0."""
+        order = FEATURE_NAMES if feature_order is None else feature_order
+        return np.fromiter((self.get(name, 0) for name in order), dtype=np.float32, count=len(order))
+
+FEATURE_NAMES = tuple(f.name for f in fields(QueryFeatures))
+_FEATURE_SET = frozenset(FEATURE_NAMES)
+
+def extract_features(query: str, explain_json=None) -> QueryFeatures:
+    """
+    Extract comprehensive features for ML model.
+    Returns consistent feature set for training and prediction.
+    """
+    # A fresh instance per call, so callers can't mutate the cached entry
+    features = QueryFeatures(**_query_features(query))
     
     # EXPLAIN-based features (if available)
     if explain_json and isinstance(explain_json, dict) and "Plan" in explain_json:
         plan = explain_json["Plan"]
-        features['plan_rows'] = plan.get("Plan Rows", 0)
-        features['plan_width'] = plan.get("Plan Width", 0)
-        features['startup_cost'] = plan.get("Startup Cost", 0.0)
-        features['total_cost'] = plan.get("Total Cost", 0.0)
-        features['plan_type'] = hash(plan.get("Node Type", "")) % 1000  # Hash node type
-    else:
-        # Default values when EXPLAIN not available
-        features['plan_rows'] = 0
-        features['plan_width'] = 0
-        features['startup_cost'] = 0.0
-        features['total_cost'] = 0.0
-        features['plan_type'] = 0
+        features.plan_rows = plan.get("Plan Rows", 0)
+        features.plan_width = plan.get("Plan Width", 0)
+        features.startup_cost = plan.get("Startup Cost", 0.0)
+        features.total_cost = plan.get("Total Cost", 0.0)
+        features.plan_type = hash(plan.get("Node Type", "")) % 1000  # Hash node type
     
     # Derived features
-    features['joins_per_table'] = features['num_joins'] / max(1, features['num_tables'])
-    features['conditions_per_join'] = features['num_conditions'] / max(1, features['num_joins']) if features['num_joins'] > 0 else 0
+    features.joins_per_table = features.num_joins / max(1, features.num_tables)
+    features.conditions_per_join = features.num_conditions / max(1, features.num_joins) if features.num_joins > 0 else 0
     
     return features
 
+def features_to_matrix(feats_list: List[Dict[str, Any]], feature_names: Sequence[str]) -> np.ndarray:
+    """Pack feature dicts (or QueryFeatures) into a (n_rows, n_features) float32 matrix in `feature_names` order."""
+    X = np.empty((len(feats_list), len(feature_names)), dtype=np.float32)
+    for i, feats in enumerate(feats_list):
+        X[i] = [feats.get(f, 0) for f in feature_names]
+    return X
+
 if __name__ == "__main__":
     test_queries = [
         "SELECT * FROM employees",
@@ -1,6 +1,7 @@
 # predict_cost.py
 import joblib
-from ml_optimizer.feature_extraction import extract_features
+import numpy as np
+from ml_optimizer.feature_extraction import extract_features, features_to_matrix
 from cost_model import get_query_cost
 import pandas as pd
 
@@ -13,26 +14,31 @@ except Exception:
     model = None
     trained_features = None
 
-def predict_cost(query: str) -> float:
+def predict_costs(queries) -> np.ndarray:
     """
-    Predict cost for a SQL query using ML model or fallback to EXPLAIN.
+    Predict costs for many SQL queries with a single model.predict call.
+    Falls back to get_query_cost per query when the model is missing or fails.
     """
-    feats = extract_features(query, None)
+    queries = list(queries)
+    if not queries:
+        return np.empty(0)
 
-    if model and trained_features:
-        # Ensure features in correct order
-        X = [[feats.get(f, 0) for f in trained_features]]
-        try:
-            return model.predict(X)[0]
-        except Exception:
-            return get_query_cost(query)
-    elif model:
-        # No feature order saved: pass as DataFrame
+    if model:
+        feats_list = [extract_features(q, None) for q in queries]
         try:
-            X = pd.DataFrame([feats])
-            return model.predict(X)[0]
+            if trained_features:
+                # Ensure features in correct order
+                X = features_to_matrix(feats_list, trained_features)
+            else:
+                # No feature order saved: pass as DataFrame
+                X = pd.DataFrame(feats_list)
+            return np.asarray(model.predict(X), dtype=float)
         except Exception:
-            return get_query_cost(query)
-    else:
-        return get_query_cost(query)
+            pass
+    return np.array([get_query_cost(q) for q in queries], dtype=float)
 
+def predict_cost(query: str) -> float:
+    """
+    Predict cost for a SQL query using ML model or fallback to EXPLAIN.
+    """
+    return predict_costs([query])[0]
@@ -1,5 +1,6 @@
 # ml_optimizer/retrain.py
 import psycopg2
+import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestRegressor
 import joblib
@@ -31,8 +32,9 @@ def retrain_model(conn, model_path="ml_optimizer/models/cost_model.pkl"):
     X = pd.DataFrame([featurize_query(q) for q in df["candidate_query"]])
     y = df["actual_cost"]
 
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
-    model.fit(X, y)
+    model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1,
+                                  max_depth=20, min_samples_leaf=5)
+    model.fit(X.to_numpy(dtype=np.float32), y.to_numpy())
 
     joblib.dump(model, model_path)
     print(f"✅ Model retrained and saved to {model_path}")
@@ -1,5 +1,5 @@
 # ml_optimizer/retrain_model.py
-import pandas as pd
+import numpy as np
 import joblib
 import json
 import os
@@ -7,6 +7,15 @@ from sqlalchemy import create_engine
 from sklearn.ensemble import RandomForestRegressor
 from dotenv import load_dotenv
 from urllib.parse import quote_plus
+from ml_optimizer.feature_extraction import features_to_matrix
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+_loads = orjson.loads if ORJSON_AVAILABLE else json.loads
 
 # Load .env variables
 load_dotenv()
@@ -23,30 +32,56 @@ if not all([DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME]):
 # Build SQLAlchemy connection string
 DB_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+FETCH_BATCH_SIZE = 10000
+
+def fetch_training_rows(engine):
+    """
+    Stream (features dict, db_cost) for every logged query with a db_cost.
+    Uses a server-side cursor, and features_json comes back as text so it is
+    parsed once here (with orjson when installed).
+    """
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor("retrain_cur")
+        cur.itersize = FETCH_BATCH_SIZE
+        cur.execute("""
+            SELECT features_json::text, db_cost
+            FROM query_logs
+            WHERE db_cost IS NOT NULL
+        """)
+        for features_json, db_cost in cur:
+            yield (_loads(features_json) if features_json else {}), float(db_cost)
+        cur.close()
+    finally:
+        conn.close()
+
 def retrain(model_file="ml_optimizer/cost_predictor.joblib"):
     engine = create_engine(DB_URL)
 
     # Fetch logs
-    df = pd.read_sql("SELECT * FROM query_logs WHERE db_cost IS NOT NULL", engine)
+    feats_list, costs = [], []
+    for feats, cost in fetch_training_rows(engine):
+        feats_list.append(feats)
+        costs.append(cost)
 
-    if df.empty:
+    if not feats_list:
         print("⚠️ No data available for retraining.")
         return
 
-    # Convert JSON features back to DataFrame
-    # If features_json is already dict, don’t load again
-    features = pd.json_normalize(df["features_json"].apply(lambda x: json.loads(x) if isinstance(x, str) else x))
-
-    X = features
-    y = df["db_cost"]
+    # Column order: every feature key, in first-seen order (missing values → 0)
+    feature_names = list(dict.fromkeys(k for feats in feats_list for k in feats))
+    # float32 inputs: trees only compare against thresholds, so half the bandwidth is enough
+    X = features_to_matrix(feats_list, feature_names)
+    y = np.asarray(costs, dtype=np.float64)
 
     # Train ML model
-    model = RandomForestRegressor(n_estimators=200, random_state=42)
+    model = RandomForestRegressor(n_estimators=200, random_state=42, n_jobs=-1,
+                                  max_depth=20, min_samples_leaf=5)
     model.fit(X, y)
 
     # Save updated model
     joblib.dump(model, model_file)
-    print(f"✅ Model retrained on {len(df)} queries. Saved to {model_file}")
+    print(f"✅ Model retrained on {len(feats_list)} queries. Saved to {model_file}")
 
 if __name__ == "__main__":
     retrain()
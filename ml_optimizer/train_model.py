@@ -1,13 +1,46 @@
+import numpy as np
 import pandas as pd
 import joblib
 from sklearn.ensemble import RandomForestRegressor
-from sqlalchemy import create_engine
 from dotenv import load_dotenv
 import os
 import urllib.parse
 
+try:
+    import connectorx as cx
+    CONNECTORX_AVAILABLE = True
+except ImportError:
+    CONNECTORX_AVAILABLE = False
+
 MODEL_PATH = "cost_predictor.joblib"  # switched to joblib for model + metadata
 
+# Select only the most important features to avoid feature mismatch
+IMPORTANT_FEATURES = ['num_tables', 'num_joins', 'query_length', 'num_conditions', 'query_complexity', 'has_order_by']
+
+# Postgres expands the JSONB features itself, so only typed floats cross the wire
+# (id is ConnectorX's partition key)
+_FEATURE_COLUMNS = ", ".join(f"(features_json->>'{f}')::double precision AS {f}" for f in IMPORTANT_FEATURES)
+TRAINING_SQL = f"""
+    SELECT id, {_FEATURE_COLUMNS}, runtime_ms
+    FROM query_logs
+    WHERE runtime_ms IS NOT NULL AND features_json IS NOT NULL
+"""
+
+def load_training_logs(db_user, db_pass, db_host, db_port, db_name) -> pd.DataFrame:
+    """
+    Read the training rows from query_logs.
+    ConnectorX streams Postgres' binary protocol in parallel straight into pandas;
+    without it, fall back to pd.read_sql over SQLAlchemy + psycopg2.
+    """
+    if CONNECTORX_AVAILABLE:
+        db_url = f"postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
+        return cx.read_sql(db_url, TRAINING_SQL, return_type="pandas",
+                           partition_on="id", partition_num=os.cpu_count() or 1)
+
+    from sqlalchemy import create_engine
+    db_url = f"postgresql+psycopg2://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
+    return pd.read_sql(TRAINING_SQL, create_engine(db_url))
+
 def train_model_function():
     # Load environment variables
     load_dotenv()
@@ -19,22 +52,10 @@ def train_model_function():
     db_port = os.getenv("DB_PORT", "5432")
     db_name = os.getenv("DB_NAME", "sql_optimizer")
 
-    db_url = f"postgresql+psycopg2://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}"
-    engine = create_engine(db_url)
-
-    # Load query logs
-    df = pd.read_sql("SELECT * FROM query_logs", engine)
-
-    # --- Normalize runtime column ---
-    if "runtime_ms" not in df.columns:
-        if "runtime" in df.columns:
-            df = df.rename(columns={"runtime": "runtime_ms"})
-        else:
-            print("⚠️ No runtime column found in query_logs, skipping training.")
-            return
+    # Load query logs (NULL runtimes/features are already filtered out in SQL)
+    df = load_training_logs(db_user, db_pass, db_host, db_port, db_name)
 
     # Drop invalid rows
-    df = df.dropna(subset=["runtime_ms", "features_json"])
     df["runtime_ms"] = pd.to_numeric(df["runtime_ms"], errors="coerce")
     df = df.dropna(subset=["runtime_ms"])
 
@@ -42,27 +63,22 @@ def train_model_function():
         print("⚠️ No valid rows for training, skipping.")
         return
 
-    # Expand JSON features
-    features = pd.json_normalize(df["features_json"])
-    if "plan_cost" in features.columns:
-        features = features.drop(columns=["plan_cost"])
-
-    # Select only the most important features to avoid feature mismatch
-    important_features = ['num_tables', 'num_joins', 'query_length', 'num_conditions', 'query_complexity', 'has_order_by']
-    available_features = [f for f in important_features if f in features.columns]
+    # A feature is available if any logged row has it (missing keys come back NULL)
+    available_features = [f for f in IMPORTANT_FEATURES if df[f].notna().any()]
     
     if len(available_features) < 3:
         print(f"❌ Not enough features available. Found: {available_features}")
         return
 
-    X = features[available_features].fillna(0)
+    X = df[available_features].fillna(0)
     y = df["runtime_ms"]
 
     print(f"✅ Training on {len(df)} samples, {len(available_features)} features: {available_features}")
 
-    # Train model
+    # Train model on a plain ndarray so the estimator doesn't record feature names;
+    # prediction paths pass float32 arrays in the saved "features" order.
     model = RandomForestRegressor(n_estimators=50, random_state=42)
-    model.fit(X, y)
+    model.fit(X.to_numpy(dtype=np.float32), y.to_numpy())
 
     # Save model + feature names
     joblib.dump({
@@ -1,4 +1,5 @@
 import sqlparse
+import heapq
 import itertools
 import random
 import logging
@@ -6,14 +7,36 @@ import re
 import pandas as pd
 import numpy as np
 import argparse
+from collections import Counter
 from typing import List, Tuple, Dict, Optional
 from dataclasses import dataclass
+from functools import lru_cache
 
-from ml_optimizer.feature_extraction import extract_features
+from ml_optimizer.feature_extraction import extract_features, features_to_matrix
 from cost_model import get_query_cost, load_cost_model
+from util.fingerprint import parameterize, bind
 
 logger = logging.getLogger(__name__)
 
+# Clause patterns, compiled once at import
+_SELECT_RE = re.compile(r'SELECT\s+(.+?)\s+FROM', re.IGNORECASE | re.DOTALL)
+_FROM_RE = re.compile(r'FROM\s+(\w+)(?:\s+(\w+))?', re.IGNORECASE)
+_JOIN_RE = re.compile(
+    r'((?:INNER\s+|LEFT\s+|RIGHT\s+|FULL\s+)?JOIN)\s+(\w+)(?:\s+(\w+))?\s+ON\s+([^;]+?)'
+    r'(?=\s+(?:INNER\s+|LEFT\s+|RIGHT\s+|FULL\s+)?JOIN|\s+WHERE|\s+GROUP|\s+ORDER|\s*$)',
+    re.IGNORECASE | re.DOTALL
+)
+_WHERE_RE = re.compile(r'WHERE\s+(.+?)(?=\s+GROUP|\s+ORDER|\s*$)', re.IGNORECASE | re.DOTALL)
+_QUALIFIER_RE = re.compile(r'\b(\w+)\.\w+')
+
+# WHERE-condition selectivity classifiers, tried in order (see selectivity_score)
+_SEL_EQ = re.compile(r'(?<![<>!])=(?!=)')
+_SEL_RANGE = re.compile(r'\bBETWEEN\b|\bIN\s*\(', re.IGNORECASE)
+_SEL_INEQ = re.compile(r'[<>]=?')
+_AND_SPLIT_RE = re.compile(r'\s+AND\s+', re.IGNORECASE)
+# A BETWEEN still waiting for its own AND
+_OPEN_BETWEEN_RE = re.compile(r'\bBETWEEN\b(?!.*\bAND\b)', re.IGNORECASE | re.DOTALL)
+
 @dataclass
 class TableInfo:
     name: str
@@ -34,37 +57,128 @@ class QueryStructure:
 def extract_structure(query: str) -> Dict:
     """Enhanced query structure extraction"""
     # Extract SELECT clause
-    select_match = re.search(r'SELECT\s+(.+?)\s+FROM', query, re.IGNORECASE | re.DOTALL)
+    select_match = _SELECT_RE.search(query)
     select_clause = select_match.group(1) if select_match else "*"
     
     # Extract FROM table with alias
-    from_match = re.search(r'FROM\s+(\w+)(?:\s+(\w+))?', query, re.IGNORECASE)
+    from_match = _FROM_RE.search(query)
     from_table = from_match.group(1) if from_match else None
     from_alias = from_match.group(2) if from_match else None
     
     # Extract JOIN clauses with their conditions
-    join_pattern = r'((?:INNER\s+|LEFT\s+|RIGHT\s+|FULL\s+)?JOIN)\s+(\w+)(?:\s+(\w+))?\s+ON\s+([^;]+?)(?=\s+(?:INNER\s+|LEFT\s+|RIGHT\s+|FULL\s+)?JOIN|\s+WHERE|\s+GROUP|\s+ORDER|\s*$)'
     joins = []
-    for match in re.finditer(join_pattern, query, re.IGNORECASE | re.DOTALL):
+    for match in _JOIN_RE.finditer(query):
+        name = (match.group(3) or match.group(2)).lower()
+        condition = match.group(4).strip()
         joins.append({
             'type': match.group(1).strip(),
             'table': match.group(2),
             'alias': match.group(3),
-            'condition': match.group(4).strip()
+            'condition': condition,
+            # join-graph edges: the other tables/aliases this ON clause references
+            'refs': frozenset(q.lower() for q in _QUALIFIER_RE.findall(condition)) - {name}
         })
     
     # Extract WHERE clause
-    where_match = re.search(r'WHERE\s+(.+?)(?=\s+GROUP|\s+ORDER|\s*$)', query, re.IGNORECASE | re.DOTALL)
+    where_match = _WHERE_RE.search(query)
     where_clause = where_match.group(1).strip() if where_match else None
     
+    # How often each table/alias is referenced in WHERE (a filter-count cardinality proxy)
+    where_refs = Counter(q.lower() for q in _QUALIFIER_RE.findall(where_clause or ""))
+    
     return {
         'select': select_clause,
         'from_table': from_table,
         'from_alias': from_alias,
         'joins': joins,
-        'where': where_clause
+        'where': where_clause,
+        'where_refs': where_refs
     }
 
+# Up to this many joins every order is enumerated; beyond it orders are sampled
+MAX_ENUMERATED_JOINS = 6
+# Distinct random orders drawn (at most) when sampling
+SAMPLED_ORDERS = 200
+# Each WHERE predicate on a table is assumed to keep 1/FILTER_REDUCTION of its rows
+FILTER_REDUCTION = 10.0
+
+def _join_order_key(perm) -> Tuple[str, ...]:
+    """Hashable identity of a join order (join dicts themselves are unhashable)"""
+    return tuple(j['alias'] or j['table'] for j in perm)
+
+def _distinct_orders(joins: List[Dict], limit: Optional[int] = None):
+    """Yield up to `limit` (default: all) distinct join orders, drawn from itertools.permutations"""
+    seen = set()
+    for perm in itertools.permutations(joins):
+        key = _join_order_key(perm)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield perm
+        if limit is not None and len(seen) >= limit:
+            return
+
+def _sampled_orders(joins: List[Dict], n_samples: int):
+    """Distinct random join orders, without materializing all n! permutations"""
+    seen = set()
+    for _ in range(n_samples):
+        perm = joins.copy()
+        random.shuffle(perm)
+        key = _join_order_key(perm)
+        if key not in seen:
+            seen.add(key)
+            yield tuple(perm)
+
+def _without_cross_joins(perm, start: str):
+    """
+    Reorder `perm` so every join references a table already joined, starting
+    from the FROM table: repeatedly take the first remaining join that connects.
+    Returns None when that's impossible (the order needs a cross join).
+    """
+    included = {start}
+    remaining = list(perm)
+    ordered = []
+    while remaining:
+        nxt = next((j for j in remaining if j['refs'] & included), None)
+        if nxt is None:
+            return None
+        remaining.remove(nxt)
+        ordered.append(nxt)
+        included.add((nxt['alias'] or nxt['table']).lower())
+    return tuple(ordered)
+
+def _connected_orders(orders, start: str):
+    """Distinct cross-join-free versions of `orders` (several may collapse into one)"""
+    seen = set()
+    for perm in orders:
+        perm = _without_cross_joins(perm, start)
+        if perm is None:
+            continue
+        key = _join_order_key(perm)
+        if key not in seen:
+            seen.add(key)
+            yield perm
+
+def _estimate_join_cost(perm, struct: Dict) -> float:
+    """
+    Left-deep cost proxy: the sum of estimated intermediate result sizes
+    (cardinality + left cost). Table sizes are unknown here, so every table
+    starts at 1 row, shrunk by FILTER_REDUCTION per WHERE reference, and each
+    join scales by its condition's selectivity bucket. This is an educated
+    guess for pruning only; the ML model still ranks the survivors.
+    """
+    refs = struct['where_refs']
+
+    def rows(name) -> float:
+        return FILTER_REDUCTION ** -refs.get((name or "").lower(), 0)
+
+    card = rows(struct['from_alias'] or struct['from_table'])
+    cost = 0.0
+    for j in perm:
+        card *= rows(j['alias'] or j['table']) * selectivity_score(j['condition']) / 4
+        cost += card
+    return cost
+
 def generate_join_permutations(struct: Dict, limit: int = 5) -> List[str]:
     """Generate different join orders"""
     if not struct['joins']:
@@ -73,20 +187,18 @@ def generate_join_permutations(struct: Dict, limit: int = 5) -> List[str]:
     candidates = []
     joins = struct['joins']
     
-    # Generate permutations for small join counts
-    if len(joins) <= 3:
-        perms = list(itertools.permutations(joins))
+    if len(joins) <= MAX_ENUMERATED_JOINS:
+        pool = _distinct_orders(joins)  # at most 6! = 720 orders
     else:
-        # Sample permutations for larger join counts
-        perms = []
-        for _ in range(limit):
-            perm = joins.copy()
-            random.shuffle(perm)
-            perms.append(tuple(perm))
-        # Remove duplicates
-        perms = list(set(perms))[:limit]
+        # n! is too many to enumerate: rank a random sample instead
+        pool = _sampled_orders(joins, SAMPLED_ORDERS)
+    # Never emit cross joins; then keep the `limit` orders with the smallest
+    # estimated intermediates (stable on ties)
+    start = (struct['from_alias'] or struct['from_table'] or "").lower()
+    pool = _connected_orders(pool, start)
+    perms = heapq.nsmallest(limit, pool, key=lambda p: _estimate_join_cost(p, struct))
     
-    for perm in perms[:limit]:
+    for perm in perms:
         query_parts = [f"SELECT {struct['select']}"]
         
         # FROM clause
@@ -112,7 +224,28 @@ def generate_join_permutations(struct: Dict, limit: int = 5) -> List[str]:
     return candidates
 
 def generate_candidates(query: str, limit: int = 10, deterministic: bool = False) -> List[Tuple[str, str]]:
-    """Generate query candidates using various optimization strategies"""
+    """
+    Generate query candidates using various optimization strategies.
+    Candidates are cached per literal-free template, so queries that differ
+    only in constants reuse the same rewrites with their own literals bound in.
+    The one random step, sampling orders for more than MAX_ENUMERATED_JOINS
+    joins, is only cached when `deterministic` seeds it.
+    """
+    template, literals = parameterize(query)
+    if literals is None:
+        return _generate_candidates(query, limit, deterministic)
+    sampled = len(extract_structure(template)['joins']) > MAX_ENUMERATED_JOINS
+    if sampled and not deterministic:
+        return _generate_candidates(query, limit, deterministic)
+    return [(strategy, bind(cand, literals))
+            for strategy, cand in _generate_candidates_cached(template, limit, sampled)]
+
+@lru_cache(maxsize=1024)
+def _generate_candidates_cached(template: str, limit: int, seeded: bool) -> Tuple[Tuple[str, str], ...]:
+    # Without sampling the output doesn't depend on the seed, so skip reseeding
+    return tuple(_generate_candidates(template, limit, deterministic=seeded))
+
+def _generate_candidates(query: str, limit: int = 10, deterministic: bool = False) -> List[Tuple[str, str]]:
     if deterministic:
         random.seed(42)
     
@@ -161,30 +294,43 @@ def generate_candidates(query: str, limit: int = 10, deterministic: bool = False
         logger.error(f"Error generating candidates: {e}")
         return [("original", query)]
 
+def selectivity_score(condition: str) -> int:
+    """
+    Rough selectivity bucket for a predicate, 1 (most selective) to 4.
+    Conditions with = are typically more selective than > or <
+    """
+    if _SEL_EQ.search(condition):
+        return 1  # Most selective
+    elif _SEL_RANGE.search(condition):
+        return 2  # Moderately selective
+    elif _SEL_INEQ.search(condition):
+        return 3  # Less selective
+    else:
+        return 4  # Least selective
+
+def _split_conditions(where_clause: str) -> List[str]:
+    """Split a WHERE clause on top-level AND, keeping `BETWEEN x AND y` whole"""
+    conditions = []
+    for part in _AND_SPLIT_RE.split(where_clause):
+        if conditions and _OPEN_BETWEEN_RE.search(conditions[-1]):
+            conditions[-1] += " AND " + part
+        else:
+            conditions.append(part.strip())
+    return conditions
+
 def reorder_where_conditions(query: str) -> str:
     """Reorder WHERE conditions for potential optimization"""
     try:
-        where_match = re.search(r'WHERE\s+(.+?)(?:\s+GROUP|\s+ORDER|\s*$)', query, re.IGNORECASE | re.DOTALL)
+        where_match = _WHERE_RE.search(query)
         if not where_match:
             return query
             
         where_clause = where_match.group(1).strip()
-        conditions = [c.strip() for c in where_clause.split(' AND ')]
+        conditions = _split_conditions(where_clause)
         
         if len(conditions) > 1:
-            # Simple heuristic: put more selective conditions first
-            # Conditions with = are typically more selective than > or <
-            def selectivity_score(condition):
-                if '=' in condition and 'BETWEEN' not in condition.upper():
-                    return 1  # Most selective
-                elif any(op in condition for op in ['BETWEEN', 'IN (']):
-                    return 2  # Moderately selective
-                elif any(op in condition for op in ['>', '<', '>=', '<=']):
-                    return 3  # Less selective
-                else:
-                    return 4  # Least selective
-            
-            conditions.sort(key=selectivity_score)
+            # Simple heuristic: put more selective conditions first (stable on ties)
+            conditions = sorted(conditions, key=selectivity_score)
             reordered_where = ' AND '.join(conditions)
             return query.replace(where_match.group(1), reordered_where)
     except Exception:
@@ -199,34 +345,40 @@ if cost_model:
 else:
     print("⚠️ No ML model found; falling back to EXPLAIN/heuristic.")
 
+def predict_batch(queries: List[str], model=None, features: Optional[List[str]] = None) -> np.ndarray:
+    """
+    ML cost predictions for all queries with a single predict call
+    (defaults to this module's model). NaN where no prediction is available.
+    Feature extraction is memoized per query text, so join-order variants are cheap.
+    """
+    if model is None:
+        model, features = cost_model, trained_features
+    if model is None or not queries:
+        return np.full(len(queries), np.nan)
+
+    feats_list = [extract_features(q, None) for q in queries]
+    try:
+        if features:
+            X = features_to_matrix(feats_list, features)
+        else:
+            X = pd.DataFrame(feats_list)
+        return np.asarray(model.predict(X), dtype=float)
+    except Exception as e:
+        print(f"⚠️ Batch prediction failed: {e}")
+        return np.full(len(queries), np.nan)
+
 def predict_cost(query, max_permutations=10):
     """Generate candidates, extract features, predict costs."""
     candidates = generate_candidates(query, limit=max_permutations)
+    preds = predict_batch([cand_query for _, cand_query in candidates])
     scored = []
 
-    for strategy, cand_query in candidates:
-        feats = extract_features(cand_query, None)
-
-        # ML prediction
-        if cost_model is not None:
-            try:
-                if trained_features:
-                    row = [feats.get(f, 0) for f in trained_features]
-                    X = pd.DataFrame([row], columns=trained_features)
-                else:
-                    X = pd.DataFrame([feats])
-                pred = float(cost_model.predict(X)[0])
-            except Exception as e:
-                print(f"⚠️ Prediction failed for {strategy}: {e}")
-                pred = get_query_cost(cand_query)
-        else:
-            pred = get_query_cost(cand_query)
-
+    for (strategy, cand_query), pred in zip(candidates, preds):
         # Ensure cost is valid
-        if pred is None or (isinstance(pred, float) and np.isnan(pred)):
+        if np.isnan(pred):
             pred = get_query_cost(cand_query)
 
-        scored.append((strategy, cand_query, pred))
+        scored.append((strategy, cand_query, float(pred)))
 
     # Sort by predicted cost
     return sorted(scored, key=lambda x: (x[2] if x[2] is not None else float("inf")))
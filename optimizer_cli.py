@@ -2,14 +2,12 @@ import argparse
 import logging
 from typing import List, Tuple, Optional
 import numpy as np
-import pandas as pd
 import time
 from datetime import datetime
 from pathlib import Path
 
-from ml_optimizer.feature_extraction import extract_features
 from cost_model import get_query_cost, load_cost_model
-from optimizer.candidate_generator import generate_candidates
+from optimizer.candidate_generator import generate_candidates, predict_batch
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -61,29 +59,14 @@ def predict_cost(query: str, max_permutations: int = 10) -> List[Tuple[str, str,
         candidates = generate_candidates(query, limit=max_permutations)
         scored: List[Tuple[str, str, float, float]] = []
 
-        for strategy, cand_query in candidates:
-            try:
-                feats = extract_features(cand_query, None)
-                pred: Optional[float] = None
-
-                # ML prediction
-                if cost_model is not None:
-                    try:
-                        if trained_features:
-                            row = [feats.get(f, 0) for f in trained_features]
-                            X = pd.DataFrame([row], columns=trained_features)
-                        else:
-                            X = pd.DataFrame([feats])
-                        pred = float(cost_model.predict(X)[0])
-                    except Exception as e:
-                        logger.warning(f"ML prediction failed for {strategy}: {e}")
-                        pred = get_query_cost(cand_query)
-                else:
-                    pred = get_query_cost(cand_query)
+        # ML prediction for every candidate in one predict call (NaN = unavailable)
+        preds = (predict_batch([cand_query for _, cand_query in candidates], cost_model, trained_features)
+                 if cost_model is not None else np.full(len(candidates), np.nan))
 
+        for (strategy, cand_query), ml_pred in zip(candidates, preds):
+            try:
                 # Ensure cost is valid
-                if pred is None or (isinstance(pred, float) and np.isnan(pred)):
-                    pred = get_query_cost(cand_query)
+                pred: Optional[float] = float(ml_pred) if not np.isnan(ml_pred) else get_query_cost(cand_query)
 
                 # Get actual cost (simplified benchmark)
                 actual_cost = benchmark_query(cand_query)
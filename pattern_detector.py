@@ -4,6 +4,60 @@ from typing import Dict, List, Set, Tuple
 from collections import defaultdict, Counter
 from dataclasses import dataclass
 from enum import Enum
+from itertools import accumulate
+from enhanced_rules import preprocess_query
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# Detector patterns, compiled once; all run against the lowercased query
+_IN_SUBQUERY_RE = re.compile(r'where\s+\w+\s+in\s*\(\s*select')
+_EXISTS_SUBQUERY_RE = re.compile(r'where\s+exists\s*\(\s*select')
+_FROM_TABLE_RE = re.compile(r'from\s+(\w+)')
+_JOIN_TABLE_RE = re.compile(r'join\s+(\w+)')
+_ON_EQUALITY_RE = re.compile(r'on\s+\w+\.\w+\s*=\s*\w+\.\w+')
+_WHERE_EQUALITY_RE = re.compile(r'where.*?\w+\.\w+\s*=\s*\w+\.\w+')
+_SCALAR_SUBQUERY_RE = re.compile(r"""
+    =\s*\(\s*select\s+\w+      # = (SELECT col
+    \s+from\s+\w+              #    FROM table
+    \s+where\s+[^)]+\)         #    WHERE ...)
+""", re.VERBOSE)
+_LEADING_WILDCARD_RE = re.compile(r"like\s+'%")
+_WHERE_FUNCTION_RE = re.compile(r"""
+    where\s+\w*\(\s*\w+\s*\)   # WHERE fn(col)
+    \s*[<>=!]                  # compared directly
+""", re.VERBOSE)
+_OFFSET_RE = re.compile(r'offset\s+(\d+)')
+_JOIN_ALIAS_RE = re.compile(r'join\s+(\w+)(?:\s+(?:as\s+)?(\w+))?')
+_SELECT_LIST_RE = re.compile(r'select\s+(.*?)\s+from')
+_PARENS_RE = re.compile(r'[()]')
+
+# Every substring the complexity metrics look for, counted in one pass.
+# No keyword is a prefix of another, so counts match str.count exactly.
+_AGGREGATE_CALLS = ('sum(', 'count(', 'avg(', 'max(', 'min(')
+_WINDOW_TERMS = ('over (', 'partition by', 'row_number')
+_COMPLEXITY_KEYWORDS = (
+    'select', 'join', 'where', '(select', *_AGGREGATE_CALLS, *_WINDOW_TERMS,
+    'with ', 'union', 'case when'
+)
+if AHOCORASICK_AVAILABLE:
+    _KEYWORD_AUTOMATON = ahocorasick.Automaton()
+    for _kw in _COMPLEXITY_KEYWORDS:
+        _KEYWORD_AUTOMATON.add_word(_kw, _kw)
+    _KEYWORD_AUTOMATON.make_automaton()
+# Zero-width lookahead fallback so overlapping occurrences are all seen
+_KEYWORD_SCAN_RE = re.compile("(?=({}))".format(
+    "|".join(re.escape(kw) for kw in sorted(_COMPLEXITY_KEYWORDS, key=len, reverse=True))
+))
+
+def _keyword_hits(q_lower: str) -> Counter:
+    """Occurrences of each _COMPLEXITY_KEYWORDS entry in the lowercased query"""
+    if AHOCORASICK_AVAILABLE:
+        return Counter(kw for _, kw in _KEYWORD_AUTOMATON.iter(q_lower))
+    return Counter(_KEYWORD_SCAN_RE.findall(q_lower))
 
 class QueryPattern(Enum):
     N_PLUS_ONE = "n_plus_one"
@@ -49,14 +103,20 @@ class QueryPatternDetector:
             'upper', 'lower', 'substring', 'replace', 'like', 'ilike',
             'regexp_replace', 'to_char', 'extract', 'date_part'
         }
+        # Any of them called somewhere after WHERE, in one search
+        self._expensive_function_re = re.compile(
+            r'where.*?(' + '|'.join(map(re.escape, self.expensive_functions)) + r')\s*\('
+        )
         
     def analyze_query(self, query: str) -> List[PatternMatch]:
         """Analyze query for all patterns"""
         matches = []
+        # Lowercase once; every detector works on the shared copy
+        q_lower = preprocess_query(query).lower
         
         for pattern_type, detector_func in self.patterns.items():
             try:
-                match = detector_func(query)
+                match = detector_func(q_lower)
                 if match:
                     matches.append(match)
             except Exception as e:
@@ -64,12 +124,10 @@ class QueryPatternDetector:
                 
         return sorted(matches, key=lambda x: x.confidence, reverse=True)
     
-    def _detect_n_plus_one(self, query: str) -> PatternMatch:
+    def _detect_n_plus_one(self, q_lower: str) -> PatternMatch:
         """Detect N+1 query patterns"""
-        q_lower = query.lower()
-        
         # Look for subquery in WHERE IN clause
-        if re.search(r'where\s+\w+\s+in\s*\(\s*select', q_lower):
+        if _IN_SUBQUERY_RE.search(q_lower):
             return PatternMatch(
                 pattern=QueryPattern.N_PLUS_ONE,
                 confidence=0.8,
@@ -80,7 +138,7 @@ class QueryPatternDetector:
             )
         
         # Look for EXISTS subqueries that could be JOINs
-        if re.search(r'where\s+exists\s*\(\s*select', q_lower):
+        if _EXISTS_SUBQUERY_RE.search(q_lower):
             return PatternMatch(
                 pattern=QueryPattern.N_PLUS_ONE,
                 confidence=0.6,
@@ -92,21 +150,19 @@ class QueryPatternDetector:
         
         return None
     
-    def _detect_cartesian_product(self, query: str) -> PatternMatch:
+    def _detect_cartesian_product(self, q_lower: str) -> PatternMatch:
         """Detect potential cartesian products"""
-        q_lower = query.lower()
-        
         # Count tables and JOINs
-        from_matches = re.findall(r'from\s+(\w+)', q_lower)
-        join_matches = re.findall(r'join\s+(\w+)', q_lower)
+        from_matches = _FROM_TABLE_RE.findall(q_lower)
+        join_matches = _JOIN_TABLE_RE.findall(q_lower)
         
         total_tables = len(from_matches) + len(join_matches)
         
         # Count JOIN conditions
-        join_conditions = len(re.findall(r'on\s+\w+\.\w+\s*=\s*\w+\.\w+', q_lower))
+        join_conditions = len(_ON_EQUALITY_RE.findall(q_lower))
         
         # Also check WHERE conditions that could be JOIN conditions
-        where_joins = len(re.findall(r'where.*?\w+\.\w+\s*=\s*\w+\.\w+', q_lower))
+        where_joins = len(_WHERE_EQUALITY_RE.findall(q_lower))
         
         total_conditions = join_conditions + where_joins
         
@@ -122,12 +178,10 @@ class QueryPatternDetector:
         
         return None
     
-    def _detect_unnecessary_subquery(self, query: str) -> PatternMatch:
+    def _detect_unnecessary_subquery(self, q_lower: str) -> PatternMatch:
         """Detect subqueries that could be simplified"""
-        q_lower = query.lower()
-        
         # Simple subquery that just selects a single value
-        if re.search(r'=\s*\(\s*select\s+\w+\s+from\s+\w+\s+where\s+[^)]+\)', q_lower):
+        if _SCALAR_SUBQUERY_RE.search(q_lower):
             return PatternMatch(
                 pattern=QueryPattern.UNNECESSARY_SUBQUERY,
                 confidence=0.7,
@@ -139,12 +193,10 @@ class QueryPatternDetector:
         
         return None
     
-    def _detect_missing_index_pattern(self, query: str) -> PatternMatch:
+    def _detect_missing_index_pattern(self, q_lower: str) -> PatternMatch:
         """Detect patterns suggesting missing indexes"""
-        q_lower = query.lower()
-        
         # LIKE with leading wildcard
-        if re.search(r"like\s+'%", q_lower):
+        if _LEADING_WILDCARD_RE.search(q_lower):
             return PatternMatch(
                 pattern=QueryPattern.MISSING_INDEX_PATTERN,
                 confidence=0.8,
@@ -155,8 +207,7 @@ class QueryPatternDetector:
             )
         
         # Functions in WHERE clause
-        func_pattern = r'where\s+\w*\(\s*\w+\s*\)\s*[<>=!]'
-        if re.search(func_pattern, q_lower):
+        if _WHERE_FUNCTION_RE.search(q_lower):
             return PatternMatch(
                 pattern=QueryPattern.MISSING_INDEX_PATTERN,
                 confidence=0.7,
@@ -168,12 +219,10 @@ class QueryPatternDetector:
         
         return None
     
-    def _detect_inefficient_pagination(self, query: str) -> PatternMatch:
+    def _detect_inefficient_pagination(self, q_lower: str) -> PatternMatch:
         """Detect inefficient pagination patterns"""
-        q_lower = query.lower()
-        
         # OFFSET without proper indexing
-        offset_match = re.search(r'offset\s+(\d+)', q_lower)
+        offset_match = _OFFSET_RE.search(q_lower)
         if offset_match:
             offset_value = int(offset_match.group(1))
             
@@ -189,16 +238,13 @@ class QueryPatternDetector:
         
         return None
     
-    def _detect_redundant_join(self, query: str) -> PatternMatch:
+    def _detect_redundant_join(self, q_lower: str) -> PatternMatch:
         """Detect potentially redundant joins"""
-        q_lower = query.lower()
-        
         # Extract all table aliases and their usage
-        join_pattern = r'join\s+(\w+)(?:\s+(?:as\s+)?(\w+))?'
-        joins = re.findall(join_pattern, q_lower)
+        joins = _JOIN_ALIAS_RE.findall(q_lower)
         
         # Extract SELECT columns
-        select_part = re.search(r'select\s+(.*?)\s+from', q_lower)
+        select_part = _SELECT_LIST_RE.search(q_lower)
         if select_part:
             select_columns = select_part.group(1)
             
@@ -217,27 +263,24 @@ class QueryPatternDetector:
         
         return None
     
-    def _detect_expensive_function(self, query: str) -> PatternMatch:
+    def _detect_expensive_function(self, q_lower: str) -> PatternMatch:
         """Detect expensive functions in WHERE clauses"""
-        q_lower = query.lower()
-        
-        for func in self.expensive_functions:
-            if re.search(rf'where.*?{func}\s*\(', q_lower):
-                return PatternMatch(
-                    pattern=QueryPattern.EXPENSIVE_FUNCTION,
-                    confidence=0.7,
-                    description=f"Expensive function '{func}' used in WHERE clause",
-                    suggestion="Consider pre-computing values or using functional index",
-                    example=f"CREATE INDEX idx_func ON table ({func}(column))",
-                    impact="Function evaluation on every row can be expensive"
-                )
+        match = self._expensive_function_re.search(q_lower)
+        if match:
+            func = match.group(1)
+            return PatternMatch(
+                pattern=QueryPattern.EXPENSIVE_FUNCTION,
+                confidence=0.7,
+                description=f"Expensive function '{func}' used in WHERE clause",
+                suggestion="Consider pre-computing values or using functional index",
+                example=f"CREATE INDEX idx_func ON table ({func}(column))",
+                impact="Function evaluation on every row can be expensive"
+            )
         
         return None
     
-    def _detect_unbounded_result(self, query: str) -> PatternMatch:
+    def _detect_unbounded_result(self, q_lower: str) -> PatternMatch:
         """Detect queries without LIMIT that could return large results"""
-        q_lower = query.lower()
-        
         if 'limit' not in q_lower and 'where' not in q_lower:
             return PatternMatch(
                 pattern=QueryPattern.UNBOUNDED_RESULT,
@@ -250,10 +293,8 @@ class QueryPatternDetector:
         
         return None
     
-    def _detect_complex_where(self, query: str) -> PatternMatch:
+    def _detect_complex_where(self, q_lower: str) -> PatternMatch:
         """Detect overly complex WHERE clauses"""
-        q_lower = query.lower()
-        
         # Count conditions
         and_count = q_lower.count(' and ')
         or_count = q_lower.count(' or ')
@@ -273,22 +314,14 @@ class QueryPatternDetector:
         
         return None
     
-    def _detect_nested_subquery(self, query: str) -> PatternMatch:
+    def _detect_nested_subquery(self, q_lower: str) -> PatternMatch:
         """Detect deeply nested subqueries"""
         # Count nesting levels
-        nesting_level = 0
-        max_nesting = 0
-        
-        for char in query.lower():
-            if char == '(':
-                nesting_level += 1
-                max_nesting = max(max_nesting, nesting_level)
-            elif char == ')':
-                nesting_level -= 1
+        max_nesting = QueryComplexityAnalyzer._calculate_nesting_depth(q_lower)
         
         # Check if there are subqueries with high nesting
-        if max_nesting > 3 and 'select' in query.lower():
-            select_count = query.lower().count('select')
+        if max_nesting > 3 and 'select' in q_lower:
+            select_count = q_lower.count('select')
             if select_count > 2:  # More than 2 SELECT statements
                 return PatternMatch(
                     pattern=QueryPattern.NESTED_SUBQUERY,
@@ -342,7 +375,8 @@ class QueryComplexityAnalyzer:
     @staticmethod
     def calculate_complexity_score(query: str) -> Dict[str, any]:
         """Calculate comprehensive complexity metrics"""
-        q_lower = query.lower()
+        q_lower = preprocess_query(query).lower
+        hits = _keyword_hits(q_lower)
         
         metrics = {
             'basic_metrics': {
@@ -351,18 +385,18 @@ class QueryComplexityAnalyzer:
                 'words': len(query.split())
             },
             'structural_complexity': {
-                'num_selects': q_lower.count('select'),
-                'num_joins': q_lower.count('join'),
-                'num_where_conditions': q_lower.count('where'),
-                'num_subqueries': q_lower.count('(select'),
+                'num_selects': hits['select'],
+                'num_joins': hits['join'],
+                'num_where_conditions': hits['where'],
+                'num_subqueries': hits['(select'],
                 'max_nesting_depth': QueryComplexityAnalyzer._calculate_nesting_depth(query)
             },
             'operation_complexity': {
-                'has_aggregates': any(func in q_lower for func in ['sum(', 'count(', 'avg(', 'max(', 'min(']),
-                'has_window_functions': any(func in q_lower for func in ['over (', 'partition by', 'row_number']),
-                'has_cte': 'with ' in q_lower,
-                'has_union': 'union' in q_lower,
-                'has_case_when': 'case when' in q_lower
+                'has_aggregates': any(hits[func] for func in _AGGREGATE_CALLS),
+                'has_window_functions': any(hits[term] for term in _WINDOW_TERMS),
+                'has_cte': hits['with '] > 0,
+                'has_union': hits['union'] > 0,
+                'has_case_when': hits['case when'] > 0
             }
         }
         
@@ -406,14 +440,6 @@ class QueryComplexityAnalyzer:
     @staticmethod
     def _calculate_nesting_depth(query: str) -> int:
         """Calculate maximum nesting depth of parentheses"""
-        depth = 0
-        max_depth = 0
-        
-        for char in query:
-            if char == '(':
-                depth += 1
-                max_depth = max(max_depth, depth)
-            elif char == ')':
-                depth -= 1
-        
-        return max_depth
\ No newline at end of file
+        # Drop everything but the parentheses in C, then walk only those
+        steps = (1 if char == '(' else -1 for char in _PARENS_RE.findall(query))
+        return max(0, max(accumulate(steps), default=0))
\ No newline at end of file
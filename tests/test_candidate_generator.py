@@ -0,0 +1,28 @@
+import unittest
+
+from optimizer import candidate_generator as cg
+
+
+QUERY = ("SELECT e.name FROM employees e JOIN departments d ON e.dept_id = d.dept_id "
+         "WHERE e.salary > {salary} AND d.name = '{dept}'")
+
+
+class GenerateCandidatesCacheTest(unittest.TestCase):
+    def setUp(self):
+        cg._generate_candidates_cached.cache_clear()
+
+    def test_literal_variants_share_one_cache_entry(self):
+        first = cg.generate_candidates(QUERY.format(salary=5000, dept="Sales"))
+        second = cg.generate_candidates(QUERY.format(salary=70000, dept="R&D"))
+
+        info = cg._generate_candidates_cached.cache_info()
+        self.assertEqual(info.currsize, 1)
+        self.assertEqual(info.hits, 1)
+        # Each variant gets its own literals bound back in
+        self.assertIn("5000", first[0][1])
+        self.assertIn("'R&D'", second[0][1])
+        self.assertEqual([s for s, _ in first], [s for s, _ in second])
+
+
+if __name__ == "__main__":
+    unittest.main()
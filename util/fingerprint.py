@@ -0,0 +1,70 @@
+# util/fingerprint.py
+"""
+Query canonicalization and compact fingerprints for cache keys
+"""
+import hashlib
+import re
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+# Quoted literals/identifiers are kept verbatim; everything else is case/whitespace-insensitive
+_QUOTED_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+_LINE_COMMENT_RE = re.compile(r"--[^\n]*")
+
+
+def canon(query: str) -> str:
+    """Normalize case and whitespace outside quoted literals so equivalent queries compare equal"""
+    parts = _QUOTED_RE.split(query.strip().rstrip(";"))
+    for i in range(0, len(parts), 2):
+        seg = _LINE_COMMENT_RE.sub(" ", parts[i])
+        words = " ".join(seg.lower().split())
+        if words and seg[0].isspace():
+            words = " " + words
+        if words and seg[-1].isspace():
+            words += " "
+        parts[i] = words or (" " if seg else "")
+    return "".join(parts).strip()
+
+
+def fp_canonical(canonical: str) -> int:
+    """64-bit fingerprint of an already-canonicalized query"""
+    data = canonical.encode("utf-8")
+    if XXHASH_AVAILABLE:
+        return xxhash.xxh3_64_intdigest(data)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def fp(query: str) -> int:
+    """64-bit fingerprint of a query's canonical form"""
+    return fp_canonical(canon(query))
+
+
+# Literal parameterization: queries that differ only in constants share one template
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"__lit(\d+)__")
+
+
+def parameterize(query: str):
+    """
+    Replace string and numeric literals with indexed placeholders.
+    Returns (template, literals), or (query, None) if the query already
+    contains placeholder-like text and can't be round-tripped safely.
+    """
+    if _PLACEHOLDER_RE.search(query):
+        return query, None
+    literals = []
+
+    def _placeholder(m):
+        literals.append(m.group(0))
+        return f"__lit{len(literals) - 1}__"
+
+    return _LITERAL_RE.sub(_placeholder, query), tuple(literals)
+
+
+def bind(template: str, literals) -> str:
+    """Put the literals from parameterize() back into a (possibly rewritten) template"""
+    return _PLACEHOLDER_RE.sub(lambda m: literals[int(m.group(1))], template)
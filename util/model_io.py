@@ -0,0 +1,21 @@
+# util/model_io.py
+"""
+joblib loading helpers
+"""
+import joblib
+
+# Uncompressed joblib dumps are plain pickles, which start with the PROTO opcode
+_PICKLE_PROTO = b"\x80"
+
+
+def is_uncompressed_dump(path: str) -> bool:
+    """True if `path` is an uncompressed joblib dump (the only kind that can be memory-mapped)"""
+    with open(path, "rb") as f:
+        return f.read(1) == _PICKLE_PROTO
+
+
+def load_dump(path: str, mmap_mode=None):
+    """joblib.load that only asks for `mmap_mode` when the dump can actually be mapped"""
+    if mmap_mode is not None and not is_uncompressed_dump(path):
+        mmap_mode = None
+    return joblib.load(path, mmap_mode=mmap_mode)